@@ -0,0 +1,176 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+STATIC_DIR = os.getenv("STATIC_DIR", "app/static")
+STATIC_URL = "/static"
+# Compressed variants only kept for these types, and only when they save
+# at least this fraction of the original size
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESSION_SAVING = 0.1
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Plain (unhashed) URLs still work, but have to be revalidated
+REVALIDATE = "no-cache"
+
+log = logging.getLogger(__name__)
+
+
+class Asset:
+    """One static file with its gzip/brotli variants, held in memory."""
+
+    def __init__(self, name: str, content: bytes):
+        self.name = name
+        self.digest = hashlib.sha256(content).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        self.hashed_name = f"{stem}.{self.digest}{ext}"
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.variants = {"identity": content}
+        if self.media_type.startswith(COMPRESSIBLE_TYPES):
+            self._add_variant("gzip", gzip.compress(content, compresslevel=9, mtime=0))
+            if BROTLI_AVAILABLE:
+                self._add_variant("br", brotli.compress(content, quality=11))
+
+    def _add_variant(self, encoding: str, body: bytes):
+        if len(body) <= len(self.variants["identity"]) * (1 - MIN_COMPRESSION_SAVING):
+            self.variants[encoding] = body
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+
+class AssetManifest:
+    """
+    Every file under STATIC_DIR, fingerprinted by content hash
+    (style.css -> style.3f2a9c1b0d4e.css) and precompressed once. Built on
+    first use, or in the background at startup; restart to pick up edits.
+    """
+
+    def __init__(self, directory: str = STATIC_DIR):
+        self.directory = directory
+        self._assets = None
+        self._by_path = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    assets[name] = Asset(name, f.read())
+        by_path = {}
+        for asset in assets.values():
+            by_path[asset.name] = (asset, False)
+            by_path[asset.hashed_name] = (asset, True)
+        self._assets, self._by_path = assets, by_path
+        log.info("Built %d static assets (brotli: %s)", len(assets), BROTLI_AVAILABLE)
+
+    def load(self):
+        if self._by_path is None:
+            with self._lock:
+                if self._by_path is None:
+                    self.build()
+
+    def lookup(self, path: str):
+        """(asset, is_fingerprinted) for a URL path under STATIC_URL, or None."""
+        self.load()
+        return self._by_path.get(path.replace(os.sep, "/"))
+
+    def url(self, name: str) -> str:
+        self.load()
+        asset = self._assets.get(name)
+        if asset is None:
+            log.warning("Unknown static asset: %s", name)
+            return f"{STATIC_URL}/{name}"
+        return f"{STATIC_URL}/{asset.hashed_name}"
+
+
+def accepted_encodings(header: str) -> dict:
+    """Accept-Encoding as {coding: q}."""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(asset: Asset, header: str) -> str:
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = "identity", 0.0
+    # Smallest first, so ties go to the better compression
+    for encoding in ("br", "gzip"):
+        q = accepted.get(encoding, wildcard)
+        if encoding in asset.variants and q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+class AssetFiles(StaticFiles):
+    """
+    /static, served from the manifest: the best variant the client accepts,
+    an ETag per variant (304 on If-None-Match), and a year of immutable
+    caching for fingerprinted URLs. Anything not in the manifest falls back
+    to plain StaticFiles.
+    """
+
+    def __init__(self, manifest: AssetManifest, **kwargs):
+        super().__init__(directory=manifest.directory, **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope) -> Response:
+        found = self.manifest.lookup(path)
+        if found is None:
+            return await super().get_response(path, scope)
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        asset, fingerprinted = found
+        request_headers = dict(scope["headers"])
+        encoding = choose_encoding(asset, request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        headers = {
+            "ETag": asset.etag(encoding),
+            "Cache-Control": IMMUTABLE if fingerprinted else REVALIDATE,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request_headers.get(b"if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match.decode("latin-1"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], headers=headers, media_type=asset.media_type)
+
+
+static_assets = AssetManifest()
+
+
+def asset_url(name: str) -> str:
+    """Template helper: {{ asset_url('style.css') }} -> /static/style.<hash>.css"""
+    return static_assets.url(name)
@@ -28,6 +28,10 @@ def get_secret_key() -> str:
     return secret_key
 
 def get_db_url() -> str:
+    # Full SQLAlchemy URL override, e.g. sqlite+aiosqlite:///./dev.db for local runs
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
     user = os.getenv("MYSQL_USER")
     password = os.getenv("MYSQL_PASSWORD")
     host = os.getenv("MYSQL_HOST")
@@ -35,4 +39,10 @@ def get_db_url() -> str:
     db = os.getenv("MYSQL_DB")
     if not all([user, password, host, port, db]):
         raise ValueError("MySQL configuration missing in .env file")
-    return f"mysql+pymysql://{user}:{password}@{host}:{port}/{db}"
+    return f"mysql+aiomysql://{user}:{password}@{host}:{port}/{db}"
+
+def get_gemini_api_key() -> str:
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in .env file")
+    return api_key
@@ -1,18 +1,63 @@
-from sqlalchemy import create_engine
+import os
+import time
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import get_db_url
+from app.metrics import DB_POOL_WAIT_SECONDS, REGISTRY
 
 SQLALCHEMY_DATABASE_URL = get_db_url()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Pool sizing is per worker process: pool_size + max_overflow connections at most
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# MySQL drops idle connections after wait_timeout (8h by default)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Schema changes are a deploy step (python -m app.migrate); this is for local runs
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """The default async pool, plus a histogram of how long checkouts wait."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+def _engine_options(url: str) -> dict:
+    if url.startswith("sqlite"):
+        # aiosqlite stand-in for local runs, pool tuning does not apply
+        return {}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, **_engine_options(SQLALCHEMY_DATABASE_URL))
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+def _pool_metrics():
+    pool = engine.pool
+    if not isinstance(pool, TimedQueuePool):
+        return []
+    return [
+        ("db_pool_checked_out", "gauge", "DB connections currently in use.", [({}, pool.checkedout())]),
+        ("db_pool_size", "gauge", "Configured DB pool size.", [({}, pool.size())]),
+        ("db_pool_overflow", "gauge", "DB connections open beyond pool_size.", [({}, max(pool.overflow(), 0))]),
+    ]
+
+REGISTRY.add_collector(_pool_metrics)
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
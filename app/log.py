@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+import sys
+import time
+from app.metrics import LOG_RECORDS_SAMPLED_OUT
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one object per line, "text" for local development
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Per message template and second: the first LOG_SAMPLE_INITIAL records are
+# written, after that only every LOG_SAMPLE_THEREAFTER-th. 0 disables sampling.
+LOG_SAMPLE_INITIAL = int(os.getenv("LOG_SAMPLE_INITIAL", "10"))
+LOG_SAMPLE_THEREAFTER = int(os.getenv("LOG_SAMPLE_THEREAFTER", "100"))
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Caps how often the same message template is written, so an upstream
+    outage logs a handful of lines per second instead of one per request.
+    Sampling keys on the unformatted message, which is why call sites pass
+    values as arguments instead of formatting them in.
+    """
+
+    def __init__(self, initial: int = LOG_SAMPLE_INITIAL, thereafter: int = LOG_SAMPLE_THEREAFTER):
+        super().__init__()
+        self.initial = initial
+        self.thereafter = thereafter
+        self._counts = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.initial <= 0:
+            return True
+        key = (record.name, record.msg)
+        second = int(time.monotonic())
+        count, counted_in = self._counts.get(key, (0, second))
+        count = count + 1 if counted_in == second else 1
+        self._counts[key] = (count, second)
+        if count <= self.initial or (count - self.initial) % self.thereafter == 0:
+            return True
+        LOG_RECORDS_SAMPLED_OUT.inc()
+        return False
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    """Sets up the `app` logger tree; uvicorn's own loggers are left alone."""
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(SamplingFilter())
+
+    logger = logging.getLogger("app")
+    logger.handlers[:] = [handler]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
@@ -1,27 +1,63 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 
-from starlette.middleware.sessions import SessionMiddleware
-from app.config import get_secret_key
-from app.database import engine, Base
-from app.routers import chat, auth
+from app.assets import AssetFiles, asset_url, static_assets
+from app.log import configure_logging
+from app.metrics import REGISTRY, MetricsMiddleware, prebind_routes
+from app.database import engine, DB_MIGRATE_ON_STARTUP
+from app.routers import chat, chat_socket, auth
+from app.services.email_service import mail_dispatcher
+from app.services.provider_router import provider_router
+from app.services.transcripts import transcript_log
+from app.sessions import ServerSessionMiddleware, session_store
+from app.transport import prewarmer
 
-Base.metadata.create_all(bind=engine)
+configure_logging()
 
-app = FastAPI(title="FastAPI AI Chat App")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    prebind_routes(app.routes)
+    if DB_MIGRATE_ON_STARTUP:
+        from app.migrate import create_schema
+        await create_schema()
+    # SDK imports happen in a thread while the app already serves requests
+    preload = asyncio.create_task(asyncio.to_thread(provider_router.preload))
+    build_assets = asyncio.create_task(asyncio.to_thread(static_assets.load))
+    mail_dispatcher.start()
+    transcript_log.start()
+    prewarmer.start()
+    yield
+    await preload
+    await build_assets
+    await transcript_log.stop()
+    await mail_dispatcher.stop()
+    await prewarmer.stop()
+    await engine.dispose()
 
-app.add_middleware(SessionMiddleware, secret_key=get_secret_key())
+app = FastAPI(title="FastAPI AI Chat App", lifespan=lifespan)
 
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+app.add_middleware(ServerSessionMiddleware, store=session_store)
+# Outermost, so the timing covers the other middleware too
+app.add_middleware(MetricsMiddleware)
+
+app.mount("/static", AssetFiles(static_assets), name="static")
 
 templates = Jinja2Templates(directory="app/templates")
+templates.env.globals["asset_url"] = asset_url
 
 app.include_router(chat.router)
+app.include_router(chat_socket.router)
 app.include_router(auth.router)
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
     user = request.session.get('user')
@@ -34,6 +70,5 @@ def home(request: Request):
         {
             "request": request,
             "user": user,
-            "token": request.session.get('token')
         }
     )
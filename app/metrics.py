@@ -0,0 +1,313 @@
+import bisect
+import time
+
+# Latency buckets in seconds, from a cache hit to a long LLM reply
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _label_str(labelnames, values) -> str:
+    if not labelnames:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(labelnames, values)) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bucket plus +Inf, not cumulative until rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    """
+    A metric family. `labels(...)` returns the child for one label set and
+    caches it, so hot paths look their children up once (at import) and then
+    only touch plain attributes.
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def samples(self):
+        for values, child in self._children.items():
+            yield self.name, _label_str(self.labelnames, values), child.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def samples(self):
+        les = [_number(b) for b in self.bounds] + ["+Inf"]
+        for values, child in self._children.items():
+            base = _label_str(self.labelnames, values)
+            prefix = base[:-1] + "," if base else "{"
+            cumulative = 0
+            for le, count in zip(les, child.counts):
+                cumulative += count
+                yield f"{self.name}_bucket", f'{prefix}le="{le}"}}', cumulative
+            yield f"{self.name}_sum", base, child.sum
+            yield f"{self.name}_count", base, cumulative
+
+
+class Registry:
+    """
+    Holds the metric families plus collectors: callables run at scrape time
+    that read counters the services already keep (cache hits, queue
+    metrics), so those cost nothing on the request path.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collect):
+        """`collect()` returns [(name, kind, help, [(labels dict, value), ...]), ...]."""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in metric.samples())
+        # Several collectors may report the same family (one per cache, say);
+        # the exposition format wants each family exactly once.
+        families = {}
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                families.setdefault(name, (kind, documentation, []))[2].extend(samples)
+        for name, (kind, documentation, samples) in families.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_str(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# ---- Application metrics -------------------------------------------------
+
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "Time to the end of the response body.",
+    ("method", "route", "status"),
+)
+LLM_REQUEST_SECONDS = histogram(
+    "llm_request_duration_seconds", "Upstream LLM call duration.", ("provider", "model"),
+)
+LLM_FIRST_TOKEN_SECONDS = histogram(
+    "llm_time_to_first_token_seconds", "Time to the first streamed token.", ("provider", "model"),
+)
+LLM_TOKENS = counter(
+    "llm_tokens_total", "Estimated tokens sent to / received from the LLM.",
+    ("provider", "model", "direction"),
+)
+LLM_REPLY_CUTOFFS = counter(
+    "llm_reply_cutoffs_total", "Replies ended early by the output budget or a stop condition.",
+    ("provider", "role", "reason"),
+)
+LLM_ERRORS = counter("llm_errors_total", "Failed upstream LLM calls.", ("provider", "model"))
+CHAT_ABANDONED = counter(
+    "chat_requests_abandoned_total", "Chat replies cancelled before they were delivered.", ("reason",),
+)
+SCOPE_REJECTIONS = counter(
+    "scope_guard_rejections_total", "Messages refused as out of scope.", ("provider", "role"),
+)
+DB_POOL_WAIT_SECONDS = histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+SMTP_BATCH_SECONDS = histogram(
+    "smtp_batch_send_duration_seconds", "Time to send one batch of queued emails.",
+)
+LOG_RECORDS_SAMPLED_OUT = counter(
+    "log_records_sampled_out_total", "Log records dropped by sampling.",
+)
+
+
+class LLMMetrics:
+    """Pre-bound children for one (provider, model), see llm_metrics()."""
+    __slots__ = ("latency", "first_token", "input_tokens", "output_tokens", "errors")
+
+    def __init__(self, provider: str, model: str):
+        self.latency = LLM_REQUEST_SECONDS.labels(provider, model)
+        self.first_token = LLM_FIRST_TOKEN_SECONDS.labels(provider, model)
+        self.input_tokens = LLM_TOKENS.labels(provider, model, "input")
+        self.output_tokens = LLM_TOKENS.labels(provider, model, "output")
+        self.errors = LLM_ERRORS.labels(provider, model)
+
+
+def llm_metrics(provider: str, model: str) -> LLMMetrics:
+    return LLMMetrics(provider, model)
+
+
+def prebind_routes(routes, statuses=("200",)):
+    """Creates the request series for every route so they exist from the first scrape."""
+    for route in routes:
+        for method in getattr(route, "methods", None) or ():
+            if method == "HEAD":
+                continue
+            for status in statuses:
+                HTTP_REQUEST_SECONDS.labels(method, route.path, status)
+
+
+def register_caches(caches: dict):
+    """Exports hit/miss/eviction counters of named LRUCache instances."""
+    def collect():
+        return [
+            ("cache_hits_total", "counter", "Cache lookups that found an entry.",
+             [({"cache": name}, c.hits) for name, c in caches.items()]),
+            ("cache_misses_total", "counter", "Cache lookups that found nothing.",
+             [({"cache": name}, c.misses) for name, c in caches.items()]),
+            ("cache_evictions_total", "counter", "Entries evicted to make room.",
+             [({"cache": name}, c.evictions) for name, c in caches.items()]),
+            ("cache_entries", "gauge", "Entries currently cached.",
+             [({"cache": name}, len(c)) for name, c in caches.items()]),
+        ]
+    REGISTRY.add_collector(collect)
+
+
+def register_counters(prefix: str, read):
+    """Exports a dict of monotonically increasing numbers as `<prefix>_<key>_total`."""
+    def collect():
+        return [
+            (f"{prefix}_{key}_total", "counter", f"{prefix} {key.replace('_', ' ')}.", [({}, value)])
+            for key, value in read().items()
+        ]
+    REGISTRY.add_collector(collect)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every HTTP request by route template, so
+    /history?cursor=... and /history share one series. Unknown paths are
+    folded into route="unmatched" to keep the label set bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route.path if route is not None else "unmatched", str(status)
+            ).observe(time.perf_counter() - start)
@@ -0,0 +1,26 @@
+"""
+Creates any missing tables. Run it as a deploy step, before the app starts:
+
+    python -m app.migrate
+
+The app itself no longer touches the schema at startup, so booting does
+not depend on the database being reachable (set DB_MIGRATE_ON_STARTUP=true
+to get the old behaviour for local development).
+"""
+import asyncio
+from app.database import Base, engine
+from app import models  # noqa: F401 (registers the tables on Base)
+
+
+async def create_schema():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def main():
+    await create_schema()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
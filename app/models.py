@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum
+from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Index, Text
+from sqlalchemy.dialects.mysql import MEDIUMTEXT
 from sqlalchemy.sql import func
 from app.database import Base
 import enum
@@ -16,6 +17,51 @@ class User(Base):
     hashed_password = Column(String(255), nullable=True)
     google_id = Column(String(255), unique=True, index=True, nullable=True)
     auth_provider = Column(String(50), default="local")
-    otp = Column(String(6), nullable=True)
-    otp_expiry = Column(DateTime, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class OneTimeCode(Base):
+    """
+    Pending email login codes, one row per address. Kept out of `users` so a
+    login spike only touches this narrow table; expired rows are ignored and
+    overwritten by the next code for the same address.
+    """
+    __tablename__ = "one_time_codes"
+
+    email = Column(String(255), primary_key=True)
+    code_hash = Column(String(64), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    expires_at = Column(DateTime, nullable=False)
+
+class Conversation(Base):
+    """
+    One chat thread per (user, role). /clear closes the open one and the
+    next message starts a new thread; old transcripts are kept.
+    """
+    __tablename__ = "conversations"
+    __table_args__ = (
+        Index("ix_conversations_user_role_created", "user_id", "role", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    role = Column(String(20), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    closed_at = Column(DateTime, nullable=True)
+
+class Message(Base):
+    __tablename__ = "messages"
+    __table_args__ = (
+        # Serves both the history pages and restoring recent memory
+        Index("ix_messages_user_role_created", "user_id", "role", "created_at", "id"),
+        Index("ix_messages_conversation", "conversation_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    # Denormalized from the conversation so history reads need no join
+    user_id = Column(Integer, nullable=False)
+    role = Column(String(20), nullable=False)
+    sender = Column(String(20), nullable=False)
+    content = Column(Text().with_variant(MEDIUMTEXT(), "mysql"), nullable=False)
+    tokens = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
@@ -1,22 +1,29 @@
 from fastapi import APIRouter, Request, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import RedirectResponse
-from authlib.integrations.starlette_client import OAuth
 from app.config import get_google_client_id, get_google_client_secret
 from app.database import get_db
 from app.models import User
-from app.utils import get_password_hash, verify_password, create_access_token
+from app.utils import get_password_hash_async, verify_password_async, create_access_token, invalidate_user
 from pydantic import BaseModel, EmailStr
-import random
-from datetime import datetime, timedelta
-from app.services.email_service import send_otp_email
+import os
+import logging
+import threading
+from app.services.email_service import mail_dispatcher
+from app.services.otp_store import EXPIRED, INVALID, LOCKED, MISSING, otp_store
+from app.transport import TIMEOUT, get_transport, prewarmer
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-oauth = OAuth()
+log = logging.getLogger(__name__)
 
-def register_oauth():
+# Authlib is only imported, and Google registered, on the first OAuth request
+_oauth = None
+_oauth_lock = threading.Lock()
+
+def register_oauth(oauth):
     oauth.register(
         name='google',
         client_id=get_google_client_id(),
@@ -29,11 +36,30 @@ def register_oauth():
         jwks_uri='https://www.googleapis.com/oauth2/v3/certs',
         client_kwargs={
             'scope': 'openid email profile',
-            'timeout': 30.0
+            # Authlib builds a client per call; these share the app-wide pool
+            'transport': get_transport(),
+            'timeout': TIMEOUT,
         }
     )
 
-register_oauth()
+def get_oauth():
+    global _oauth
+    if _oauth is None:
+        with _oauth_lock:
+            if _oauth is None:
+                from authlib.integrations.starlette_client import OAuth
+                oauth = OAuth()
+                register_oauth(oauth)
+                _oauth = oauth
+    return _oauth
+
+if os.getenv("GOOGLE_CLIENT_ID"):
+    prewarmer.add_origin('https://oauth2.googleapis.com')
+    prewarmer.add_origin('https://openidconnect.googleapis.com')
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -48,98 +74,87 @@ class OTPVerifyRequest(BaseModel):
     otp: str
 
 @router.post("/signup")
-async def signup(user_data: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user_data.email).first()
+async def signup(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await get_user_by_email(db, user_data.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     new_user = User(
         email=user_data.email,
         name=user_data.name,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=await get_password_hash_async(user_data.password),
         auth_provider="local"
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    invalidate_user(new_user.email)
     return {"message": "User created successfully"}
 
 @router.post("/token")
 @router.post("/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not user.hashed_password or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await get_user_by_email(db, form_data.username)
+    if not user or not user.hashed_password or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
     access_token = create_access_token(data={"sub": user.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/email-login")
-async def email_login(login_data: EmailLoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == login_data.email).first()
+async def email_login(login_data: EmailLoginRequest, db: AsyncSession = Depends(get_db)):
+    user = await get_user_by_email(db, login_data.email)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     
     if user.auth_provider != "google":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Password required for this account")
     
-    # Generate 6-digit OTP
-    otp = str(random.randint(100000, 999999))
-    user.otp = otp
-    user.otp_expiry = datetime.now() + timedelta(minutes=5)
-    db.commit()
-    print(f"DEBUG: OTP for {user.email} is {otp}, expires at {user.otp_expiry}")
+    otp = await otp_store.issue(user.email)
+    log.debug("OTP issued for %s", user.email)
     
-    # Send email
-    if send_otp_email(user.email, otp):
+    # Delivery happens in the background mail workers
+    if mail_dispatcher.enqueue_otp(user.email, otp):
         return {"message": "OTP sent to your email"}
     else:
-        raise HTTPException(status_code=500, detail="Failed to send OTP email")
+        raise HTTPException(status_code=503, detail="Too many pending emails, please retry shortly")
 
 @router.post("/verify-otp")
-async def verify_otp(verify_data: OTPVerifyRequest, db: Session = Depends(get_db)):
+async def verify_otp(verify_data: OTPVerifyRequest):
     email = verify_data.email.strip()
-    user = db.query(User).filter(User.email == email).first()
-    
-    if not user:
-        print(f"DEBUG: User not found for email: '{email}'")
-        raise HTTPException(status_code=400, detail="User not found")
-        
-    if not user.otp or not user.otp_expiry:
-        print(f"DEBUG: No OTP record found for {email}")
-        raise HTTPException(status_code=400, detail="No OTP requested")
-    
-    print(f"DEBUG: Verifying OTP for {email}. Stored: '{user.otp}', Received: '{verify_data.otp}'")
     
-    if user.otp != verify_data.otp:
-        raise HTTPException(status_code=400, detail="Invalid OTP")
+    # Codes are only issued to existing accounts, so no user lookup is needed
+    result = await otp_store.consume(email, verify_data.otp)
+    log.debug("OTP verification for %s: %s", email, result)
     
-    now = datetime.now()
-    if now > user.otp_expiry:
-        print(f"DEBUG: OTP expired for {email}. Now: {now}, Expiry: {user.otp_expiry}")
-        user.otp = None
-        user.otp_expiry = None
-        db.commit()
+    if result == MISSING:
+        raise HTTPException(status_code=400, detail="No OTP requested")
+    if result == EXPIRED:
         raise HTTPException(status_code=400, detail="OTP expired")
+    if result == LOCKED:
+        raise HTTPException(status_code=429, detail="Too many attempts, please request a new OTP")
+    if result == INVALID:
+        raise HTTPException(status_code=400, detail="Invalid OTP")
     
-    # Valid OTP
-    user.otp = None
-    user.otp_expiry = None
-    db.commit()
-    
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data={"sub": email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/google")
 async def login_google(request: Request):
-    google = oauth.create_client('google')
+    try:
+        google = get_oauth().create_client('google')
+    except ValueError:
+        raise HTTPException(status_code=503, detail="Google login is not configured")
     redirect_uri = request.url_for('auth_callback')
+    # Authlib keeps the OAuth state in the session
+    await request.session.load()
     return await google.authorize_redirect(request, redirect_uri)
 
 @router.get("/callback")
-async def auth_callback(request: Request, db: Session = Depends(get_db)):
+async def auth_callback(request: Request, db: AsyncSession = Depends(get_db)):
     try:
-        google = oauth.create_client('google')
+        google = get_oauth().create_client('google')
+        await request.session.load()
         token = await google.authorize_access_token(request)
         user_info = token.get('userinfo')
         if not user_info: 
@@ -149,7 +164,7 @@ async def auth_callback(request: Request, db: Session = Depends(get_db)):
         google_id = user_info.get('sub')
         name = user_info.get('name')
 
-        db_user = db.query(User).filter(User.email == email).first()
+        db_user = await get_user_by_email(db, email)
         if not db_user:
             db_user = User(
                 email=email,
@@ -158,15 +173,19 @@ async def auth_callback(request: Request, db: Session = Depends(get_db)):
                 auth_provider="google"
             )
             db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
+            await db.commit()
+            await db.refresh(db_user)
+            invalidate_user(db_user.email)
         elif not db_user.google_id:
             db_user.google_id = google_id
             db_user.auth_provider = "google" 
-            db.commit()
+            await db.commit()
+            invalidate_user(db_user.email)
 
         access_token = create_access_token(data={"sub": db_user.email})
         
+        # A new id for the logged-in session, the pre-login one held the OAuth state
+        await request.session.rotate()
         request.session['user'] = {
             "email": db_user.email, 
             "name": db_user.name,
@@ -176,25 +195,29 @@ async def auth_callback(request: Request, db: Session = Depends(get_db)):
         
         return RedirectResponse(url='/')
     except Exception as e:
-        print(f"OAuth Error details: {repr(e)}")
+        log.exception("Google OAuth callback failed")
         raise HTTPException(status_code=400, detail=f"OAuth failed: {repr(e)}")
 
 from fastapi.templating import Jinja2Templates
+from app.assets import asset_url
 
 templates = Jinja2Templates(directory="app/templates")
+templates.env.globals["asset_url"] = asset_url
 
 @router.get("/login")
 async def login_page(request: Request):
+    await request.session.load()
     if request.session.get('user'):
         return RedirectResponse(url="/")
     return templates.TemplateResponse("login.html", {"request": request})
 
 @router.get("/set_session")
-async def set_session(request: Request, token: str, email: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def set_session(request: Request, token: str, email: str, db: AsyncSession = Depends(get_db)):
+    user = await get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    await request.session.rotate()
     request.session['user'] = {"email": user.email, "name": user.name}
     request.session['token'] = token
     return RedirectResponse(url='/')
@@ -1,21 +1,145 @@
-from fastapi import APIRouter, Depends
-from app.schemas.chat import ChatRequest, ChatResponse
-from app.services.groq_service import get_groq_response, clear_memory
+import asyncio
+import json
+import math
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.schemas.chat import ChatBatchRequest, ChatRequest, ChatResponse, HistoryMessage, HistoryPage
+from app.services.cancellation import (
+    ClientDisconnected, active_requests, stream_until_disconnected, until_disconnected,
+)
+from app.services.memory_store import conversation_store
+from app.services.provider_router import BATCH_MAX_ITEMS, error_reply, provider_router
+from app.services.rate_limiter import admission, RateLimited
+from app.services.streaming import to_sse
+from app.services.transcripts import history_page
 from app.utils import get_current_user
 from app.models import User
 
 router = APIRouter()
 
+async def enforce_user_quota(current_user: User = Depends(get_current_user)):
+    try:
+        await admission.admit_user(current_user.id)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="You are sending messages too fast. Please slow down.",
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+    return current_user
+
 @router.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest, current_user: User = Depends(get_current_user)):
-    reply, in_w, out_w = get_groq_response(request.message, request.role)
+async def chat(request: ChatRequest, http_request: Request, current_user: User = Depends(enforce_user_quota)):
+    try:
+        reply, in_w, out_w = await until_disconnected(
+            http_request,
+            provider_router.get_response(
+                request.message, request.role, current_user.id, preferred=request.provider
+            ),
+            current_user.id,
+        )
+    except ClientDisconnected as e:
+        # Nobody is listening any more; the status only shows up in metrics
+        return Response(status_code=e.status_code)
     return ChatResponse(
         reply=reply,
         input_words=in_w,
         output_words=out_w
     )
 
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request, current_user: User = Depends(enforce_user_quota)):
+    tokens = stream_until_disconnected(
+        http_request,
+        provider_router.stream_response(
+            request.message, request.role, current_user.id, preferred=request.provider
+        ),
+        current_user.id,
+    )
+    return StreamingResponse(
+        to_sse(tokens),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/chat/batch")
+async def chat_batch(request: ChatBatchRequest, http_request: Request, current_user: User = Depends(get_current_user)):
+    """
+    Answers many independent messages (no conversation memory) and streams
+    one NDJSON line per item as soon as it is ready:
+    {"index", "reply", "input_words", "output_words"} or {"index", "error"}.
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BATCH_MAX_ITEMS} items per batch",
+        )
+
+    async def admit():
+        # A batch waits for the user's quota instead of failing its items
+        while True:
+            try:
+                return await admission.admit_user(current_user.id)
+            except RateLimited as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def lines():
+        results = provider_router.batch(
+            [(item.message, item.role, item.provider) for item in request.items],
+            current_user.id,
+            admit=admit,
+        )
+        try:
+            async for index, result, error in results:
+                if error is not None:
+                    line = {"index": index, "error": error_reply(error)}
+                else:
+                    reply, in_w, out_w = result
+                    line = {"index": index, "reply": reply, "input_words": in_w, "output_words": out_w}
+                yield json.dumps(line) + "\n"
+        finally:
+            # Cancels the items still running when the client goes away
+            await results.aclose()
+
+    return StreamingResponse(
+        stream_until_disconnected(http_request, lines(), current_user.id),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
 @router.post("/clear")
-def clear_chat(current_user: User = Depends(get_current_user)):
-    clear_memory()
+async def clear_chat(current_user: User = Depends(get_current_user)):
+    # Replies still in flight would write to the memory we are about to
+    # clear; wait until they have unwound, their last write included
+    await active_requests.cancel_user(current_user.id)
+    await conversation_store.clear(current_user.id)
     return {"status": "cleared"}
+
+@router.get("/history", response_model=HistoryPage)
+async def history(
+    role: Literal["teacher", "interviewer", "debugger"],
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        messages, next_cursor = await history_page(db, current_user.id, role, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return HistoryPage(
+        messages=[
+            HistoryMessage(
+                id=m.id,
+                conversation_id=m.conversation_id,
+                sender=m.sender,
+                content=m.content,
+                created_at=m.created_at,
+            )
+            for m in messages
+        ],
+        next_cursor=next_cursor,
+    )
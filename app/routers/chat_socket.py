@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import math
+import os
+from typing import Optional
+from urllib.parse import urlsplit
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from pydantic import TypeAdapter, ValidationError
+from app.schemas.chat import SocketCancel, SocketChat, SocketFrame, SocketResume
+from app.services.live_replies import CANCELLED, DONE, reply_hub
+from app.services.provider_router import ERROR_REPLY, provider_router
+from app.services.rate_limiter import admission, RateLimited
+from app.utils import user_from_token
+
+# Replies one user may have generating at the same time, over all sockets
+WS_MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "4"))
+# Origins besides the app's own host that may open /ws/chat, comma separated
+# (e.g. https://chat.example.com). The socket authenticates with the session
+# cookie, so other sites must not be able to open it in a user's browser.
+WS_ALLOWED_ORIGINS = {o.strip().rstrip("/") for o in os.getenv("WS_ALLOWED_ORIGINS", "").split(",") if o.strip()}
+
+router = APIRouter()
+
+log = logging.getLogger(__name__)
+
+_frames = TypeAdapter(SocketFrame)
+
+
+class ChatSocket:
+    """
+    One authenticated /ws/chat connection. Every chat runs as its own task,
+    so messages for different roles are answered concurrently over the same
+    socket, and each reply is followed by a task streaming its tokens.
+
+    Server frames:
+        {"type": "token", "id", "text", "offset", "end"}
+        {"type": "done", "id", "input_words", "output_words"}
+        {"type": "cancelled", "id"}
+        {"type": "error", "id", "detail"[, "retry_after"]}
+    A client that reconnects sends {"type": "resume", "id", "offset": end}
+    with the `end` of the last token it got and continues from there.
+    """
+
+    def __init__(self, websocket: WebSocket, user):
+        self.websocket = websocket
+        self.user = user
+        self._send_lock = asyncio.Lock()
+        self._tasks = {}
+
+    async def send(self, frame: dict):
+        async with self._send_lock:
+            await self.websocket.send_json(frame)
+
+    async def error(self, message_id, detail: str, **extra):
+        await self.send({"type": "error", "id": message_id, "detail": detail, **extra})
+
+    async def handle(self, raw: str):
+        try:
+            frame = _frames.validate_json(raw)
+        except ValidationError:
+            await self.error(None, "Invalid frame")
+            return
+        if isinstance(frame, SocketChat):
+            await self.chat(frame)
+        elif isinstance(frame, SocketCancel):
+            reply = reply_hub.get(self.user.id, frame.id)
+            if reply is not None:
+                reply_hub.cancel(reply)
+        elif isinstance(frame, SocketResume):
+            reply = reply_hub.get(self.user.id, frame.id)
+            if reply is None:
+                await self.error(frame.id, "Unknown or expired message")
+                return
+            self._spawn(frame.id, self.follow(reply, frame.offset, resumed=True))
+
+    async def chat(self, frame: SocketChat):
+        if reply_hub.get(self.user.id, frame.id) is not None:
+            await self.error(frame.id, "Duplicate message id")
+            return
+        if reply_hub.running(self.user.id) >= WS_MAX_INFLIGHT:
+            await self.error(frame.id, "Too many replies in progress")
+            return
+        self._spawn(frame.id, self._start(frame))
+
+    async def _start(self, frame: SocketChat):
+        try:
+            await admission.admit_user(self.user.id)
+        except RateLimited as e:
+            await self.error(
+                frame.id, "You are sending messages too fast. Please slow down.",
+                retry_after=math.ceil(e.retry_after),
+            )
+            return
+        # Checked again: other connections may have started replies meanwhile
+        if reply_hub.running(self.user.id) >= WS_MAX_INFLIGHT:
+            await self.error(frame.id, "Too many replies in progress")
+            return
+        stream = provider_router.stream_response(
+            frame.message, frame.role, self.user.id, preferred=frame.provider
+        )
+        await self.follow(reply_hub.start(self.user.id, frame.id, stream))
+
+    async def follow(self, reply, offset: int = 0, resumed: bool = False):
+        reply_hub.watch(reply, resumed)
+        try:
+            async for start, text in reply.read(offset):
+                await self.send({
+                    "type": "token", "id": reply.message_id,
+                    "text": text, "offset": start, "end": start + len(text),
+                })
+            if reply.status == DONE and reply.usage is not None:
+                await self.send({"type": "done", "id": reply.message_id, **reply.usage.model_dump()})
+            elif reply.status == CANCELLED:
+                await self.send({"type": "cancelled", "id": reply.message_id})
+            else:
+                await self.error(reply.message_id, ERROR_REPLY)
+        finally:
+            reply_hub.unwatch(reply)
+
+    def _spawn(self, message_id: str, coro):
+        previous = self._tasks.get(message_id)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.ensure_future(coro)
+        self._tasks[message_id] = task
+        task.add_done_callback(lambda _: self._forget(message_id, task))
+
+    def _forget(self, message_id: str, task: asyncio.Task):
+        if self._tasks.get(message_id) is task:
+            del self._tasks[message_id]
+        if not task.cancelled() and task.exception() is not None:
+            # Sending to a socket that just closed; the reply itself carries on
+            log.debug("WebSocket follower for %s ended: %s", message_id, task.exception())
+
+    async def close(self):
+        # Stops the followers only; unfinished replies stay resumable for a while
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def allowed_origin(websocket: WebSocket) -> bool:
+    # Browsers always send Origin on WebSocket handshakes; other clients
+    # may not, and cannot ride on a user's cookie anyway
+    origin = websocket.headers.get("origin")
+    if origin is None:
+        return True
+    origin = origin.rstrip("/")
+    return origin in WS_ALLOWED_ORIGINS or urlsplit(origin).netloc == websocket.headers.get("host")
+
+
+@router.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, token: Optional[str] = None):
+    if not allowed_origin(websocket):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    # Authenticated once for the whole connection: ?token=... from API
+    # clients, the login session cookie from the browser UI
+    if not token:
+        token = (await websocket.session.load()).get("token")
+    user = await user_from_token(token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    connection = ChatSocket(websocket, user)
+    try:
+        while True:
+            await connection.handle(await websocket.receive_text())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await connection.close()
@@ -1,11 +1,56 @@
-from pydantic import BaseModel
-from typing import Literal
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Literal, Optional, Union
 
 class ChatRequest(BaseModel):
     message: str
     role: Literal["teacher", "interviewer", "debugger"]
+    # Preferred backend; the router still fails over when it is unhealthy
+    provider: Optional[Literal["groq", "gemini"]] = None
+
+class ChatBatchRequest(BaseModel):
+    items: List[ChatRequest] = Field(min_length=1)
 
 class ChatResponse(BaseModel):
     reply: str
     input_words: int
     output_words: int
+
+class ChatUsage(BaseModel):
+    """Trailer sent once a streamed reply is complete."""
+    input_words: int
+    output_words: int
+
+class HistoryMessage(BaseModel):
+    id: int
+    conversation_id: int
+    sender: Literal["user", "assistant"]
+    content: str
+    created_at: datetime
+
+class HistoryPage(BaseModel):
+    messages: List[HistoryMessage]
+    # Pass back as `cursor` for the next (older) page; None on the last page
+    next_cursor: Optional[str] = None
+
+# ---- /ws/chat frames sent by the client ----------------------------------
+
+class SocketChat(BaseModel):
+    type: Literal["chat"]
+    # Client-chosen id; replies, cancel and resume refer to it
+    id: str = Field(min_length=1, max_length=64)
+    message: str
+    role: Literal["teacher", "interviewer", "debugger"]
+    provider: Optional[Literal["groq", "gemini"]] = None
+
+class SocketCancel(BaseModel):
+    type: Literal["cancel"]
+    id: str
+
+class SocketResume(BaseModel):
+    type: Literal["resume"]
+    id: str
+    # The `end` of the last token frame received for this message
+    offset: int = Field(0, ge=0)
+
+SocketFrame = Annotated[Union[SocketChat, SocketCancel, SocketResume], Field(discriminator="type")]
@@ -0,0 +1,139 @@
+import asyncio
+from contextlib import contextmanager
+from app.metrics import CHAT_ABANDONED
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its reply was ready; the work was cancelled."""
+    status_code = 499
+
+
+class _StoppingStream:
+    """
+    Stands in for a task for a stream that ends by itself once asked to:
+    cancel() asks it to stop, awaiting it waits until it has closed.
+    """
+
+    def __init__(self, stop: asyncio.Event):
+        self._stop = stop
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def cancel(self):
+        self._stop.set()
+
+    def finish(self):
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def __await__(self):
+        return asyncio.shield(self.closed).__await__()
+
+
+class ActiveRequests:
+    """
+    Chat work in flight per user (tasks, or anything with cancel() that can
+    be awaited), so /clear can stop replies that would otherwise still land
+    in the memory it is about to wipe, and wait until they have unwound.
+    """
+
+    def __init__(self):
+        self._active = {}
+
+    @contextmanager
+    def track(self, user_id, work):
+        active = self._active.setdefault(user_id, set())
+        active.add(work)
+        try:
+            yield
+        finally:
+            active.discard(work)
+            if not active:
+                self._active.pop(user_id, None)
+
+    def add(self, user_id, work):
+        self._active.setdefault(user_id, set()).add(work)
+
+    def discard(self, user_id, work):
+        active = self._active.get(user_id)
+        if active is not None:
+            active.discard(work)
+            if not active:
+                del self._active[user_id]
+
+    async def cancel_user(self, user_id) -> int:
+        # A copy: the work removes itself from the set as it unwinds
+        active = list(self._active.pop(user_id, ()))
+        for work in active:
+            work.cancel()
+        if active:
+            CHAT_ABANDONED.labels("cleared").inc(len(active))
+            await asyncio.gather(*active, return_exceptions=True)
+        return len(active)
+
+
+active_requests = ActiveRequests()
+
+
+async def wait_for_disconnect(request):
+    """Returns once the client has closed the connection. Needs the body read already."""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def until_disconnected(request, coro, user_id=None):
+    """
+    Awaits `coro`, cancelling it when the client disconnects (or /clear is
+    called for `user_id`). Cancelling ends the upstream HTTP call, frees the
+    provider slot and skips the history write. Raises ClientDisconnected.
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        with active_requests.track(user_id, task):
+            await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        CHAT_ABANDONED.labels("disconnect").inc()
+        raise ClientDisconnected()
+    if task.cancelled():
+        raise ClientDisconnected()
+    return task.result()
+
+
+async def stream_until_disconnected(request, stream, user_id=None):
+    """
+    Passes `stream` through until the client disconnects (or /clear is
+    called for `user_id`), then closes it. Unlike waiting for a send to
+    fail, this also notices a client that leaves before the first token.
+    """
+    stopped = asyncio.Event()
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    watcher.add_done_callback(lambda _: stopped.set())
+    stop = asyncio.ensure_future(stopped.wait())
+    work = _StoppingStream(stopped)
+    item = None
+    try:
+        with active_requests.track(user_id, work):
+            while True:
+                item = asyncio.ensure_future(stream.__anext__())
+                await asyncio.wait({item, stop}, return_when=asyncio.FIRST_COMPLETED)
+                if not item.done():
+                    if watcher.done() and not watcher.cancelled():
+                        CHAT_ABANDONED.labels("disconnect").inc()
+                    return
+                if isinstance(item.exception(), StopAsyncIteration):
+                    return
+                yield item.result()
+    finally:
+        if item is not None and not item.done():
+            item.cancel()
+            await asyncio.gather(item, return_exceptions=True)
+        watcher.cancel()
+        stop.cancel()
+        try:
+            await stream.aclose()
+        finally:
+            work.finish()
@@ -1,8 +1,13 @@
+import asyncio
+import logging
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 from dotenv import load_dotenv
+from app.metrics import SMTP_BATCH_SECONDS, register_counters
 
 load_dotenv()
 
@@ -10,14 +15,30 @@ SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+# false for relays that take mail without AUTH (e.g. aiosmtpd in development)
+SMTP_AUTH = os.getenv("SMTP_AUTH", "true").lower() == "true"
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER or "")
+# Without AUTH, a relay is enough; with it, the credentials are needed too
+SMTP_CONFIGURED = not SMTP_AUTH or bool(SMTP_USER and SMTP_PASSWORD)
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))
+# Connections idle for longer than this get a NOOP before they are reused
+SMTP_IDLE_CHECK_SECONDS = float(os.getenv("SMTP_IDLE_CHECK_SECONDS", "30"))
 
-def send_otp_email(receiver_email: str, otp: str):
-    if not SMTP_USER or not SMTP_PASSWORD:
-        print(f"DEBUG: Email sending is not configured. OTP for {receiver_email} is: {otp}")
-        return True
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "2"))
+MAIL_QUEUE_MAX = int(os.getenv("MAIL_QUEUE_MAX", "1000"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "4"))
+MAIL_RETRY_BASE_DELAY = float(os.getenv("MAIL_RETRY_BASE_DELAY", "1.0"))
+# Local development only: log login codes when email is not configured.
+# Anyone who can read the logs could use them to log in.
+MAIL_DEV_LOG_CODES = os.getenv("MAIL_DEV_LOG_CODES", "false").lower() == "true"
+
+log = logging.getLogger(__name__)
 
+def build_otp_message(receiver_email: str, otp: str) -> MIMEMultipart:
     msg = MIMEMultipart()
-    msg['From'] = SMTP_USER
+    msg['From'] = SMTP_FROM
     msg['To'] = receiver_email
     msg['Subject'] = "Your AI Chat Verification Code"
 
@@ -39,14 +60,201 @@ def send_otp_email(receiver_email: str, otp: str):
     </html>
     """
     msg.attach(MIMEText(body, 'html'))
+    return msg
+
+
+class SMTPConnectionPool:
+    """
+    Keeps logged-in SMTP connections around so each message does not pay
+    for a new TCP + STARTTLS + AUTH handshake. Used from worker threads.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_USE_TLS:
+            server.starttls()
+        if SMTP_AUTH:
+            server.login(SMTP_USER, SMTP_PASSWORD)
+        return server
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, idle_since = self._idle.pop()
+            if time.monotonic() - idle_since < SMTP_IDLE_CHECK_SECONDS:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close(server)
+        return self._connect()
+
+    def release(self, server: smtplib.SMTP, broken: bool = False):
+        if broken:
+            self._close(server)
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((server, time.monotonic()))
+                return
+        self._close(server)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server)
+
+    @staticmethod
+    def _close(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+
+class MailJob:
+    __slots__ = ("message", "attempts")
+
+    def __init__(self, message):
+        self.message = message
+        self.attempts = 0
+
 
-    try:
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.send_message(msg)
-        server.quit()
+class MailDispatcher:
+    """
+    Background OTP delivery. Handlers enqueue and return immediately;
+    workers drain the queue in batches over pooled SMTP connections and
+    retry failed messages with exponential backoff.
+    """
+
+    def __init__(self, workers: int = MAIL_WORKERS, queue_max: int = MAIL_QUEUE_MAX,
+                 batch_size: int = MAIL_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        # Created up front so enqueue() works before start(); mail queued
+        # then goes out once the workers run
+        self.queue = asyncio.Queue(maxsize=queue_max)
+        self.pool = SMTPConnectionPool(size=workers)
+        self._tasks = []
+        self.metrics = {
+            "enqueued": 0,
+            "rejected": 0,
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+            "batches": 0,
+            "send_seconds": 0.0,
+        }
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5.0):
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                log.warning("Mail queue not drained on shutdown, %d messages dropped", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await asyncio.to_thread(self.pool.close)
+
+    def enqueue(self, message) -> bool:
+        try:
+            self.queue.put_nowait(MailJob(message))
+        except asyncio.QueueFull:
+            self.metrics["rejected"] += 1
+            return False
+        self.metrics["enqueued"] += 1
         return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+
+    def enqueue_otp(self, receiver_email: str, otp: str) -> bool:
+        if not SMTP_CONFIGURED:
+            if MAIL_DEV_LOG_CODES:
+                log.warning("Email sending is not configured, OTP for %s is %s", receiver_email, otp)
+            else:
+                log.warning("Email sending is not configured, login code for %s not delivered", receiver_email)
+            return True
+        return self.enqueue(build_otp_message(receiver_email, otp))
+
+    async def _worker(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            start = time.perf_counter()
+            try:
+                failed = await asyncio.to_thread(self._send_batch, batch)
+            except Exception as e:
+                log.error("Error sending email batch: %s", e)
+                failed = batch
+            elapsed = time.perf_counter() - start
+            SMTP_BATCH_SECONDS.observe(elapsed)
+            self.metrics["send_seconds"] += elapsed
+            self.metrics["batches"] += 1
+            self.metrics["sent"] += len(batch) - len(failed)
+
+            for job in failed:
+                self._retry_later(job)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _send_batch(self, batch: list) -> list:
+        """Sends a batch over one connection, returns the jobs that failed."""
+        failed = []
+        server = None
+        for job in batch:
+            for attempt in range(2):
+                try:
+                    if server is None:
+                        server = self.pool.acquire()
+                    server.send_message(job.message)
+                    break
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    # Dead connection: drop it and try once more on a fresh one
+                    if server is not None:
+                        self.pool.release(server, broken=True)
+                        server = None
+                    if attempt:
+                        log.error("Error sending email: %s", e)
+                        failed.append(job)
+                except smtplib.SMTPException as e:
+                    log.error("Error sending email: %s", e)
+                    failed.append(job)
+                    break
+        if server is not None:
+            self.pool.release(server)
+        return failed
+
+    def _retry_later(self, job: MailJob):
+        job.attempts += 1
+        if job.attempts >= MAIL_MAX_ATTEMPTS:
+            self.metrics["failed"] += 1
+            log.error("Giving up on email to %s after %d attempts", job.message['To'], job.attempts)
+            return
+        self.metrics["retried"] += 1
+        delay = MAIL_RETRY_BASE_DELAY * 2 ** (job.attempts - 1)
+        asyncio.get_running_loop().call_later(delay, self._requeue, job)
+
+    def _requeue(self, job: MailJob):
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.metrics["failed"] += 1
+
+
+mail_dispatcher = MailDispatcher()
+register_counters("mail", lambda: mail_dispatcher.metrics)
@@ -1,16 +1,58 @@
 
+import os
 import re
-from google import genai
+import sys
+import time
+import logging
+import threading
 from app.config import get_gemini_api_key
-from google.genai.errors import ClientError
-
-client = genai.Client(api_key=get_gemini_api_key())
-
-chat_memory = []
-
-MAX_HISTORY_MESSAGES = 6
+from app.metrics import SCOPE_REJECTIONS, llm_metrics
+from app.transport import async_client, first_byte_timeout, prewarmer
+from app.schemas.chat import ChatUsage
+from app.services.streaming import WordCounter
+from app.services.memory_store import conversation_store
+from app.services.response_cache import response_cache
+from app.services.singleflight import inflight
+from app.services.rate_limiter import admission
+from app.services.scope_guard import ScopeGuard
+from app.services.prompts import assistant_turn, transcript, user_turn
+from app.services.reply_limits import output_budgets
+from app.services.tokens import PROMPT_TOKEN_BUDGETS, count_tokens, fit_history
+
+log = logging.getLogger(__name__)
+
+# Gemini is optional, so the client is only built once a request needs it.
+# google.genai is by far the heaviest import in the app, it is deferred too.
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                from google.genai import types
+                _client = genai.Client(
+                    api_key=get_gemini_api_key(),
+                    http_options=types.HttpOptions(httpx_async_client=async_client()),
+                )
+    return _client
+
+def is_client_error(error: Exception) -> bool:
+    # Only an SDK call can raise one, so the errors module is loaded by then
+    errors = sys.modules.get("google.genai.errors")
+    return errors is not None and isinstance(error, errors.ClientError)
+
+if os.getenv("GEMINI_API_KEY"):
+    prewarmer.add_origin("https://generativelanguage.googleapis.com")
+
+MODEL = "gemini-2.5-flash"
 MAX_INPUT_WORDS = 500
 MAX_OUTPUT_WORDS = 10000
+# Gemini 2.5 counts thinking against max_output_tokens, so thinking gets a
+# fixed allowance on top of the learned reply budget.
+THINKING_BUDGET = int(os.getenv("GEMINI_THINKING_BUDGET", "1024"))
 
 FORMAT_RULES = (
     "Formatting rules (STRICT):\n"
@@ -59,42 +101,25 @@ ROLE_PROMPTS = {
     )
 }
 
-ALLOWED_TOPICS = [
-    "python",
-    "ai",
-    "artificial intelligence",
-    "machine learning",
-    "deep learning",
-    "fastapi"
-]
-
-PYTHON_CODE_PATTERNS = [
-    r"\bprint\s*\(",
-    r"\bdef\s+\w+\(",
-    r"\bclass\s+\w+",
-    r"\bimport\s+\w+",
-    r"\bfor\s+\w+\s+in\s+",
-    r"\bif\s+.+:",
-]
-
-def looks_like_python_code(message: str) -> bool:
-    return any(re.search(pattern, message) for pattern in PYTHON_CODE_PATTERNS)
+# Fixed start of every prompt per role, built once so the prefix is
+# byte-stable across requests and Gemini's implicit caching can reuse it.
+PROMPT_PREFIXES = {
+    role: prompt + ("\nUser request:\n" if role == "interviewer" else "\nConversation so far:\n")
+    for role, prompt in ROLE_PROMPTS.items()
+}
+PROMPT_SUFFIX = f"\n\nKeep answer under {MAX_OUTPUT_WORDS} words."
 
-def is_allowed_topic(message: str, role: str) -> bool:
-    msg = message.lower()
+SYSTEM_PROMPT_TOKENS = {role: count_tokens(prompt) for role, prompt in ROLE_PROMPTS.items()}
 
-    # Debugger always allows Python code
-    if role == "debugger" and looks_like_python_code(message):
-        return True
+# Gemini never allowed the generic coding/programming topics
+SCOPE_GUARD = ScopeGuard(topics=("python", "ai", "machine_learning", "deep_learning", "fastapi"))
 
-    return any(topic in msg for topic in ALLOWED_TOPICS)
+_metrics = llm_metrics("gemini", MODEL)
+_scope_rejections = {role: SCOPE_REJECTIONS.labels("gemini", role) for role in ROLE_PROMPTS}
 
 def word_count(text: str) -> int:
     return len(text.split())
 
-def clear_memory():
-    chat_memory.clear()
-
 def clean_output(text: str) -> str:
     """
     Removes unwanted markdown leftovers just in case
@@ -103,72 +128,216 @@ def clean_output(text: str) -> str:
     text = re.sub(r"#{2,}", "", text)
     return text.strip()
 
-def get_gemini_response(user_message: str, role: str):
-    input_words = word_count(user_message)
+def build_prompt(user_message: str, role: str, window: list) -> str:
+    if role == "interviewer":
+        return PROMPT_PREFIXES["interviewer"] + user_message
+    return transcript(PROMPT_PREFIXES[role], window, user_message, PROMPT_SUFFIX)
 
-    if input_words > MAX_INPUT_WORDS:
-        return (
-            f"Input too long. Please stay within {MAX_INPUT_WORDS} words.",
-            input_words,
-            0
-        )
+def check_request(user_message: str, role: str):
+    """
+    Returns a rejection message for requests we won't send to Gemini, else None.
+    """
+    if word_count(user_message) > MAX_INPUT_WORDS:
+        return f"Input too long. Please stay within {MAX_INPUT_WORDS} words."
 
-    if not is_allowed_topic(user_message, role):
+    if not SCOPE_GUARD.is_allowed(user_message, role):
+        _scope_rejections[role].inc()
         return (
             "Sorry, this question is outside the allowed scope.\n"
-            "Please ask only Python or AI related questions.",
-            input_words,
-            0
+            "Please ask only Python or AI related questions."
         )
+    return None
+
+async def load_window(user_id, user_message: str, role: str) -> list:
+    # Interviewer questions are one-shot and never use memory
+    if role == "interviewer":
+        return []
+    history = await conversation_store.get(user_id, role)
+    budget = PROMPT_TOKEN_BUDGETS[MODEL] - SYSTEM_PROMPT_TOKENS[role] - count_tokens(user_message)
+    return fit_history(history, budget)
+
+def prompt_tokens(user_message: str, role: str, window: list) -> int:
+    return SYSTEM_PROMPT_TOKENS[role] + sum(turn.tokens for turn in window) + count_tokens(user_message)
+
+def generation_config(limit):
+    from google.genai import types
+    return types.GenerateContentConfig(
+        max_output_tokens=limit.max_tokens + THINKING_BUDGET,
+        thinking_config=types.ThinkingConfig(thinking_budget=THINKING_BUDGET),
+    )
 
+def hit_max_tokens(response) -> bool:
+    candidates = response.candidates or ()
+    return any(getattr(c.finish_reason, "name", None) == "MAX_TOKENS" for c in candidates)
+
+async def complete(prompt: str, input_tokens: int, limit) -> str:
+    if limit.stop is not None:
+        # Streamed under the hood so the stop condition can end generation early
+        return clean_output("".join([text async for text in stream_chunks(prompt, input_tokens, limit)]))
+    await admission.admit("gemini", MODEL, input_tokens)
+    _metrics.input_tokens.inc(input_tokens)
+    start = time.perf_counter()
     try:
+        response = await get_client().aio.models.generate_content(
+            model=MODEL,
+            contents=prompt,
+            config=generation_config(limit),
+        )
+    except Exception:
+        _metrics.errors.inc()
+        raise
+    _metrics.latency.observe(time.perf_counter() - start)
+    reply = clean_output(response.text or "")
+    output_tokens = count_tokens(reply)
+    limit.finish(output_tokens, truncated=hit_max_tokens(response))
+    _metrics.output_tokens.inc(output_tokens)
+    await admission.settle("gemini", MODEL, output_tokens)
+    return reply
+
+async def stream_chunks(prompt: str, input_tokens: int, limit):
+    await admission.admit("gemini", MODEL, input_tokens)
+    _metrics.input_tokens.inc(input_tokens)
+    output_tokens = 0
+    truncated = False
+    first_chunk = True
+    start = time.perf_counter()
+    stream = None
+    try:
+        stream = await get_client().aio.models.generate_content_stream(
+            model=MODEL,
+            contents=prompt,
+            config=generation_config(limit),
+        )
+        async for chunk in first_byte_timeout(stream):
+            truncated = hit_max_tokens(chunk)
+            text = chunk.text
+            if not text:
+                continue
+            if first_chunk:
+                _metrics.first_token.observe(time.perf_counter() - start)
+                first_chunk = False
+            output_tokens += count_tokens(text)
+            text = limit.feed(text)
+            if text:
+                # Markdown runs split across chunks can slip through here,
+                # clean_output on the full text only runs for the non-streaming path.
+                yield re.sub(r"\*{2,}|#{2,}", "", text)
+            if limit.stopped:
+                break
+        rest = limit.flush()
+        if rest:
+            yield re.sub(r"\*{2,}|#{2,}", "", rest)
+        _metrics.latency.observe(time.perf_counter() - start)
+    except Exception:
+        _metrics.errors.inc()
+        raise
+    finally:
+        if stream is not None:
+            # Closing the stream ends the upstream request when we stopped early
+            await stream.aclose()
+        limit.finish(output_tokens, truncated)
+        _metrics.output_tokens.inc(output_tokens)
+        await admission.settle("gemini", MODEL, output_tokens)
+
+async def remember(user_id, user_message: str, role: str, reply: str):
+    if role == "interviewer":
+        return
+    await conversation_store.append(user_id, role, user_turn(user_message), assistant_turn(reply))
+
+async def get_gemini_response(user_message: str, role: str, user_id, save_history: bool = True,
+                              raise_errors: bool = False, use_history: bool = True):
+    input_words = word_count(user_message)
 
-        if role == "interviewer":
-            prompt = (
-                ROLE_PROMPTS["interviewer"]
-                + "\nUser request:\n"
-                + user_message
-            )
-
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=prompt
-            )
-
-            reply = clean_output(response.text)
-            return reply, input_words, word_count(reply)
-
-        # Teacher / Debugger with memory
-        chat_memory.append(f"User: {user_message}")
-        recent_history = chat_memory[-MAX_HISTORY_MESSAGES:]
+    rejection = check_request(user_message, role)
+    if rejection:
+        return rejection, input_words, 0
 
-        prompt = (
-            ROLE_PROMPTS[role]
-            + "\nConversation so far:\n"
-            + "\n".join(recent_history)
-            + f"\n\nKeep answer under {MAX_OUTPUT_WORDS} words."
-        )
+    try:
+        window = await load_window(user_id, user_message, role) if use_history else []
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
+        cache_key = response_cache.key("gemini", MODEL, role, user_message, window)
+        reply = await response_cache.get(cache_key)
+        if reply is None:
+            prompt = build_prompt(user_message, role, window)
+            input_tokens = prompt_tokens(user_message, role, window)
+            limit = output_budgets.limit("gemini", role, user_message)
+            reply = await inflight.do(cache_key, lambda: complete(prompt, input_tokens, limit))
+            response_cache.set(cache_key, reply)
 
-        reply = clean_output(response.text)
-        chat_memory.append(f"AI: {reply}")
+        if save_history:
+            await remember(user_id, user_message, role, reply)
 
         return reply, input_words, word_count(reply)
 
-    except ClientError:
-        return (
-            "AI service limit reached. Please try again later.",
-            input_words,
-            0
-        )
+    except Exception as e:
+        if is_client_error(e):
+            log.warning("Gemini request rejected: %s", e, extra={"provider": "gemini", "model": MODEL})
+            if raise_errors:
+                raise
+            return (
+                "AI service limit reached. Please try again later.",
+                input_words,
+                0
+            )
 
-    except Exception:
+        log.error("Gemini request failed: %s", e, extra={"provider": "gemini", "model": MODEL})
+        if raise_errors:
+            raise
         return (
             "Something went wrong. Please try again.",
             input_words,
             0
         )
+
+async def stream_gemini_response(user_message: str, role: str, user_id, raise_errors: bool = False):
+    """
+    Streaming variant of get_gemini_response: yields cleaned text chunks as
+    they arrive and finishes with a ChatUsage trailer. With raise_errors,
+    failures before the first chunk propagate so the caller can fail over.
+    """
+    input_words = word_count(user_message)
+
+    rejection = check_request(user_message, role)
+    if rejection:
+        yield rejection
+        yield ChatUsage(input_words=input_words, output_words=0)
+        return
+
+    counter = WordCounter()
+    parts = []
+    try:
+        window = await load_window(user_id, user_message, role)
+
+        cache_key = response_cache.key("gemini", MODEL, role, user_message, window)
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            parts.append(cached)
+            counter.feed(cached)
+            yield cached
+        else:
+            prompt = build_prompt(user_message, role, window)
+            input_tokens = prompt_tokens(user_message, role, window)
+            limit = output_budgets.limit("gemini", role, user_message)
+            async for text in inflight.stream(cache_key, lambda: stream_chunks(prompt, input_tokens, limit)):
+                parts.append(text)
+                counter.feed(text)
+                yield text
+            response_cache.set(cache_key, "".join(parts).strip())
+
+        await remember(user_id, user_message, role, "".join(parts).strip())
+
+    except Exception as e:
+        limited = is_client_error(e)
+        if limited:
+            log.warning("Gemini request rejected: %s", e, extra={"provider": "gemini", "model": MODEL})
+        else:
+            log.error("Gemini request failed: %s", e, extra={"provider": "gemini", "model": MODEL})
+        if raise_errors and not parts:
+            raise
+        if not parts:
+            if limited:
+                yield "AI service limit reached. Please try again later."
+            else:
+                yield "Something went wrong. Please try again."
+
+    yield ChatUsage(input_words=input_words, output_words=counter.count)
@@ -1,16 +1,52 @@
 import os
-from groq import Groq
+import time
+import asyncio
+import logging
+import threading
 from app.config import get_groq_api_key
+from app.metrics import llm_metrics
+from app.transport import async_client, first_byte_timeout, prewarmer
+from app.schemas.chat import ChatUsage
+from app.services.streaming import WordCounter
+from app.services.memory_store import conversation_store
+from app.services.response_cache import response_cache
+from app.services.singleflight import inflight
+from app.services.rate_limiter import admission
+from app.services.prompts import assistant_turn, chat_messages, user_turn
+from app.services.reply_limits import output_budgets
+from app.services.tokens import PROMPT_TOKEN_BUDGETS, count_tokens, fit_history
 
-client = Groq(
-    api_key=get_groq_api_key(),
-)
+# Built on first use (or by ProviderRouter.preload in the background at
+# startup) so importing the app does not pay for the Groq SDK.
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from groq import AsyncGroq
+                _client = AsyncGroq(
+                    api_key=get_groq_api_key(),
+                    http_client=async_client(),
+                )
+    return _client
 
-chat_memory = []
+prewarmer.add_origin(os.getenv("GROQ_BASE_URL") or "https://api.groq.com")
 
-MAX_HISTORY_MESSAGES = 10
+MODEL = "llama-3.3-70b-versatile"
 MAX_INPUT_WORDS = 1000
-MAX_OUTPUT_WORDS = 2000
+
+# Upper bound on Groq calls in flight per worker. Requests beyond this wait
+# for a free slot instead of queueing inside the SDK connection pool
+# (which is also capped at 100 connections).
+MAX_CONCURRENT_REQUESTS = int(os.getenv("GROQ_MAX_CONCURRENT_REQUESTS", "100"))
+
+_request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+log = logging.getLogger(__name__)
+_metrics = llm_metrics("groq", MODEL)
 
 
 FORMAT_RULES = (
@@ -55,69 +91,192 @@ ROLE_PROMPTS = {
     )
 }
 
-ALLOWED_TOPICS = [
-    "python",
-    "ai",
-    "artificial intelligence",
-    "machine learning",
-    "deep learning",
-    "fastapi",
-    "coding",
-    "programming"
-]
-
-def is_allowed_topic(message: str, role: str) -> bool:
-    msg = message.lower()
-    if role == "debugger": 
-        return True 
-    return any(t in msg for t in ALLOWED_TOPICS)
+DEFAULT_ROLE_PROMPT = "You are a helpful AI assistant."
+
+# Built once per role and shared by every request, which keeps the prompt
+# prefix byte-stable for Groq's prompt caching.
+SYSTEM_MESSAGES = {
+    role: {"role": "system", "content": prompt + "\n" + FORMAT_RULES}
+    for role, prompt in {**ROLE_PROMPTS, None: DEFAULT_ROLE_PROMPT}.items()
+}
+
+SYSTEM_PROMPT_TOKENS = {
+    role: count_tokens(message["content"]) for role, message in SYSTEM_MESSAGES.items()
+}
 
 def word_count(text: str) -> int:
     return len(text.split())
 
-def clear_memory():
-    chat_memory.clear()
+def system_message(role: str) -> dict:
+    return SYSTEM_MESSAGES.get(role, SYSTEM_MESSAGES[None])
+
+def history_window(user_message: str, role: str, history: list) -> list:
+    budget = PROMPT_TOKEN_BUDGETS[MODEL] - SYSTEM_PROMPT_TOKENS.get(role, 0) - count_tokens(user_message)
+    return fit_history(history, budget)
+
+def build_messages(user_message: str, role: str, window: list):
+    return chat_messages(system_message(role), window, user_message)
+
+def prompt_tokens(user_message: str, role: str, window: list) -> int:
+    return SYSTEM_PROMPT_TOKENS.get(role, 0) + sum(turn.tokens for turn in window) + count_tokens(user_message)
+
+async def complete(messages: list, input_tokens: int, limit) -> str:
+    if limit.stop is not None:
+        # Streamed under the hood so the stop condition can end generation early
+        return "".join([token async for token in stream_tokens(messages, input_tokens, limit)]).rstrip()
+    await admission.admit("groq", MODEL, input_tokens)
+    _metrics.input_tokens.inc(input_tokens)
+    async with _request_slots:
+        start = time.perf_counter()
+        try:
+            chat_completion = await get_client().chat.completions.create(
+                messages=messages,
+                model=MODEL,
+                max_tokens=limit.max_tokens,
+                temperature=0.7,
+            )
+        except Exception:
+            _metrics.errors.inc()
+            raise
+        _metrics.latency.observe(time.perf_counter() - start)
+    choice = chat_completion.choices[0]
+    # None when the completion is empty or was filtered; trailing whitespace
+    # trimmed like the streamed replies
+    reply = (choice.message.content or "").rstrip()
+    output_tokens = count_tokens(reply)
+    limit.finish(output_tokens, truncated=choice.finish_reason == "length")
+    _metrics.output_tokens.inc(output_tokens)
+    await admission.settle("groq", MODEL, output_tokens)
+    return reply
+
+async def stream_tokens(messages: list, input_tokens: int, limit):
+    """
+    Yields reply tokens, cut off by `limit`: once the role's stop condition
+    is met the upstream stream is closed so Groq stops generating.
+    """
+    await admission.admit("groq", MODEL, input_tokens)
+    _metrics.input_tokens.inc(input_tokens)
+    output_tokens = 0
+    truncated = False
+    first_token = True
+    try:
+        async with _request_slots:
+            start = time.perf_counter()
+            stream = None
+            try:
+                stream = await get_client().chat.completions.create(
+                    messages=messages,
+                    model=MODEL,
+                    max_tokens=limit.max_tokens,
+                    temperature=0.7,
+                    stream=True,
+                )
+                async for chunk in first_byte_timeout(stream):
+                    if not chunk.choices:
+                        continue
+                    truncated = chunk.choices[0].finish_reason == "length"
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        if first_token:
+                            _metrics.first_token.observe(time.perf_counter() - start)
+                            first_token = False
+                        output_tokens += count_tokens(token)
+                        token = limit.feed(token)
+                        if token:
+                            yield token
+                        if limit.stopped:
+                            break
+                rest = limit.flush()
+                if rest:
+                    yield rest
+            except Exception:
+                _metrics.errors.inc()
+                raise
+            finally:
+                if stream is not None:
+                    await stream.close()
+            _metrics.latency.observe(time.perf_counter() - start)
+    finally:
+        limit.finish(output_tokens, truncated)
+        _metrics.output_tokens.inc(output_tokens)
+        await admission.settle("groq", MODEL, output_tokens)
+
+async def remember(user_id, user_message: str, role: str, reply: str):
+    await conversation_store.append(user_id, role, user_turn(user_message), assistant_turn(reply))
 
-def get_groq_response(user_message: str, role: str):
+async def get_groq_response(user_message: str, role: str, user_id, save_history: bool = True,
+                            raise_errors: bool = False, use_history: bool = True):
     input_words = word_count(user_message)
 
     if input_words > MAX_INPUT_WORDS:
         return (f"Input too long ({input_words} words). Limit is {MAX_INPUT_WORDS}.", input_words, 0)
-    
-
 
     try:
-        
-        messages = []
-        
-      
-        system_content = ROLE_PROMPTS.get(role, "You are a helpful AI assistant.") + "\n" + FORMAT_RULES
-        messages.append({"role": "system", "content": system_content})
-
-        
-        recent_history_strs = chat_memory[-MAX_HISTORY_MESSAGES:]
-        for h in recent_history_strs:
-            if h.startswith("User: "):
-                messages.append({"role": "user", "content": h.replace("User: ", "", 1)})
-            elif h.startswith("AI: "):
-                messages.append({"role": "assistant", "content": h.replace("AI: ", "", 1)})
-        
-        messages.append({"role": "user", "content": user_message})
-
-        chat_completion = client.chat.completions.create(
-            messages=messages,
-            model="llama-3.3-70b-versatile", 
-            max_tokens=MAX_OUTPUT_WORDS,
-            temperature=0.7,
-        )
-
-        reply = chat_completion.choices[0].message.content
-        
-        chat_memory.append(f"User: {user_message}")
-        chat_memory.append(f"AI: {reply}")
+        history = await conversation_store.get(user_id, role) if use_history else []
+        window = history_window(user_message, role, history)
+
+        cache_key = response_cache.key("groq", MODEL, role, user_message, window)
+        reply = await response_cache.get(cache_key)
+        if reply is None:
+            messages = build_messages(user_message, role, window)
+            input_tokens = prompt_tokens(user_message, role, window)
+            limit = output_budgets.limit("groq", role, user_message)
+            reply = await inflight.do(cache_key, lambda: complete(messages, input_tokens, limit))
+            response_cache.set(cache_key, reply)
+
+        if save_history:
+            await remember(user_id, user_message, role, reply)
 
         return reply, input_words, word_count(reply)
 
     except Exception as e:
-        print(f"Groq Error: {e}")
+        log.error("Groq request failed: %s", e, extra={"provider": "groq", "model": MODEL})
+        if raise_errors:
+            raise
         return ("Sorry, I encountered an error with the AI service.", input_words, 0)
+
+async def stream_groq_response(user_message: str, role: str, user_id, raise_errors: bool = False):
+    """
+    Same as get_groq_response, but yields reply tokens as Groq produces them
+    and finishes with a ChatUsage trailer. With raise_errors, failures before
+    the first token propagate so the caller can fail over.
+    """
+    input_words = word_count(user_message)
+
+    if input_words > MAX_INPUT_WORDS:
+        yield f"Input too long ({input_words} words). Limit is {MAX_INPUT_WORDS}."
+        yield ChatUsage(input_words=input_words, output_words=0)
+        return
+
+    counter = WordCounter()
+    parts = []
+    try:
+        history = await conversation_store.get(user_id, role)
+        window = history_window(user_message, role, history)
+
+        cache_key = response_cache.key("groq", MODEL, role, user_message, window)
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            parts.append(cached)
+            counter.feed(cached)
+            yield cached
+        else:
+            messages = build_messages(user_message, role, window)
+            input_tokens = prompt_tokens(user_message, role, window)
+            limit = output_budgets.limit("groq", role, user_message)
+            async for token in inflight.stream(cache_key, lambda: stream_tokens(messages, input_tokens, limit)):
+                parts.append(token)
+                counter.feed(token)
+                yield token
+            response_cache.set(cache_key, "".join(parts).rstrip())
+
+        await remember(user_id, user_message, role, "".join(parts).rstrip())
+
+    except Exception as e:
+        log.error("Groq request failed: %s", e, extra={"provider": "groq", "model": MODEL})
+        if raise_errors and not parts:
+            raise
+        if not parts:
+            yield "Sorry, I encountered an error with the AI service."
+
+    yield ChatUsage(input_words=input_words, output_words=counter.count)
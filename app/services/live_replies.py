@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+from app.cache import LRUCache
+from app.metrics import register_counters
+from app.schemas.chat import ChatUsage
+from app.services.cancellation import active_requests
+
+# A reply keeps generating this long after its last WebSocket watcher went
+# away, so a client that reconnects can resume it; after that it is cancelled.
+WS_RESUME_GRACE = float(os.getenv("WS_RESUME_GRACE", "15"))
+# Finished replies stay resumable for this long
+WS_REPLY_TTL = float(os.getenv("WS_REPLY_TTL", "300"))
+WS_MAX_REPLIES = int(os.getenv("WS_MAX_REPLIES", "10000"))
+
+log = logging.getLogger(__name__)
+
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+
+class LiveReply:
+    """
+    One reply generated for a WebSocket client. The text is buffered as it
+    streams in, so any number of readers can follow it live or replay it
+    from a character offset after reconnecting.
+    """
+
+    def __init__(self, user_id, message_id: str):
+        self.user_id = user_id
+        self.message_id = message_id
+        self.parts = []
+        self.length = 0
+        self.usage = None
+        self.status = RUNNING
+        self.task = None
+        self.watchers = 0
+        self.changed = asyncio.Event()
+        self.abandon_timer = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status != RUNNING
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def pump(self, stream):
+        try:
+            async for item in stream:
+                if isinstance(item, ChatUsage):
+                    self.usage = item
+                elif item:
+                    self.parts.append(item)
+                    self.length += len(item)
+                    self._notify()
+            self.status = DONE
+        except asyncio.CancelledError:
+            self.status = CANCELLED
+        except Exception as e:
+            log.error("Live reply failed: %s", e)
+            self.status = FAILED
+        finally:
+            await stream.aclose()
+            self._notify()
+
+    async def read(self, offset: int = 0):
+        """Yields (start offset, text) from `offset` on until the reply has finished."""
+        position = min(max(offset, 0), self.length)
+        backlog = "".join(self.parts)[position:]
+        index = len(self.parts)
+        if backlog:
+            yield position, backlog
+            position += len(backlog)
+        while True:
+            while index < len(self.parts):
+                part = self.parts[index]
+                yield position, part
+                position += len(part)
+                index += 1
+            if self.finished:
+                return
+            await self.changed.wait()
+
+
+class ReplyHub:
+    """
+    Live replies by (user id, client message id). Generation runs in its
+    own task, independent of the socket that asked for it: a dropped
+    connection only stops the reply once nobody has resumed it within
+    WS_RESUME_GRACE seconds.
+
+    Replies live in this process: a client can only resume on the worker
+    that generated the reply, so multi-worker deployments need sticky
+    routing for /ws/chat (e.g. on the session cookie).
+    """
+
+    def __init__(self, grace: float = WS_RESUME_GRACE, ttl: float = WS_REPLY_TTL,
+                 max_replies: int = WS_MAX_REPLIES):
+        self.grace = grace
+        self._replies = LRUCache(maxsize=max_replies, ttl=ttl)
+        # user id -> replies still generating, across all their connections
+        self._running = {}
+        self.metrics = {"started": 0, "resumed": 0, "cancelled": 0, "abandoned": 0}
+
+    def get(self, user_id, message_id: str):
+        return self._replies.get((user_id, message_id))
+
+    def running(self, user_id) -> int:
+        return self._running.get(user_id, 0)
+
+    def start(self, user_id, message_id: str, stream) -> LiveReply:
+        reply = LiveReply(user_id, message_id)
+        reply.task = asyncio.ensure_future(reply.pump(stream))
+        reply.task.add_done_callback(lambda _: self._finished(reply))
+        self._replies.set((user_id, message_id), reply)
+        self._running[user_id] = self.running(user_id) + 1
+        # /clear cancels it like any other in-flight chat
+        active_requests.add(user_id, reply.task)
+        self.metrics["started"] += 1
+        return reply
+
+    def _finished(self, reply: LiveReply):
+        active_requests.discard(reply.user_id, reply.task)
+        if self._running.get(reply.user_id, 0) <= 1:
+            self._running.pop(reply.user_id, None)
+        else:
+            self._running[reply.user_id] -= 1
+        # Re-stored so the TTL counts from the end of the reply
+        self._replies.set((reply.user_id, reply.message_id), reply)
+
+    def watch(self, reply: LiveReply, resumed: bool = False):
+        reply.watchers += 1
+        if reply.abandon_timer is not None:
+            reply.abandon_timer.cancel()
+            reply.abandon_timer = None
+        if resumed:
+            self.metrics["resumed"] += 1
+
+    def unwatch(self, reply: LiveReply):
+        reply.watchers -= 1
+        if reply.watchers == 0 and not reply.finished:
+            reply.abandon_timer = asyncio.get_running_loop().call_later(self.grace, self._abandon, reply)
+
+    def _abandon(self, reply: LiveReply):
+        reply.abandon_timer = None
+        if reply.watchers == 0 and not reply.finished:
+            self.metrics["abandoned"] += 1
+            reply.task.cancel()
+
+    def cancel(self, reply: LiveReply):
+        if not reply.finished:
+            self.metrics["cancelled"] += 1
+            reply.task.cancel()
+
+
+reply_hub = ReplyHub()
+register_counters("live_replies", lambda: reply_hub.metrics)
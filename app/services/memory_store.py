@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from app.cache import LRUCache
+from app.metrics import register_caches
+from app.services.prompts import Turn, decode_turn
+from app.services.transcripts import transcript_log
+
+# "memory" keeps conversations in this process only; "sqlite" shares them
+# between uvicorn workers on the same host through a local database file.
+MEMORY_BACKEND = os.getenv("CHAT_MEMORY_BACKEND", "memory")
+MEMORY_SQLITE_PATH = os.getenv("CHAT_MEMORY_SQLITE_PATH", "chat_memory.sqlite3")
+MEMORY_TTL_SECONDS = int(os.getenv("CHAT_MEMORY_TTL_SECONDS", str(6 * 60 * 60)))
+MAX_CONVERSATIONS = int(os.getenv("CHAT_MEMORY_MAX_CONVERSATIONS", "10000"))
+MAX_MESSAGES_PER_CONVERSATION = int(os.getenv("CHAT_MEMORY_MAX_MESSAGES", "40"))
+
+
+async def _finish_in_thread(func, *args):
+    """
+    Runs a blocking write in a thread. A cancelled caller still waits for
+    the thread to finish, so the write cannot land after a /clear that
+    cancelled it and then wiped the conversation.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+
+
+def _decode(messages: str) -> list:
+    # JSON has no tuples, turns come back as [role, content, tokens] lists
+    return [decode_turn(m) for m in json.loads(messages)]
+
+
+class SQLiteBackend:
+    """
+    Shared conversation table in a local SQLite file.
+
+    Every write bumps a per-conversation version, so a worker that already
+    holds a conversation in its LRU tier can revalidate it without
+    transferring or decoding the messages again.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " user_id TEXT NOT NULL,"
+                " role TEXT NOT NULL,"
+                " version INTEGER NOT NULL,"
+                " messages TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (user_id, role))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_conversations_updated_at"
+                " ON conversations (updated_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, user_id, role, known_version=None):
+        """
+        Returns (version, messages). messages is None when known_version is
+        still current; (None, None) when there is no live conversation.
+        """
+        row = self._connect().execute(
+            "SELECT version, CASE WHEN version = ? THEN NULL ELSE messages END"
+            " FROM conversations WHERE user_id = ? AND role = ? AND updated_at > ?",
+            (known_version, str(user_id), role, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None, None
+        version, messages = row
+        return version, None if messages is None else _decode(messages)
+
+    def append(self, user_id, role, messages, limit: int):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT version, messages FROM conversations"
+                " WHERE user_id = ? AND role = ? AND updated_at > ?",
+                (str(user_id), role, now - self.ttl),
+            ).fetchone()
+            version, history = (row[0], _decode(row[1])) if row else (0, [])
+            history = (history + list(messages))[-limit:]
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations (user_id, role, version, messages, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (str(user_id), role, version + 1, json.dumps(history), now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._writes += 1
+        if self._writes % 500 == 0:
+            conn.execute("DELETE FROM conversations WHERE updated_at <= ?", (now - self.ttl,))
+        return version + 1, history
+
+    def delete(self, user_id, role=None):
+        if role is None:
+            self._connect().execute("DELETE FROM conversations WHERE user_id = ?", (str(user_id),))
+        else:
+            self._connect().execute(
+                "DELETE FROM conversations WHERE user_id = ? AND role = ?", (str(user_id), role)
+            )
+
+
+class ConversationStore:
+    """
+    Conversation history keyed by (user id, role). Entries are
+    prompts.Turn records.
+
+    Conversations live in a bounded in-process LRU tier and expire after
+    `ttl` seconds without activity. When a shared backend is configured it
+    is the source of truth and the LRU tier only saves the decode work.
+
+    Every append and clear is also handed to `journal` (the durable
+    transcript log). Without a backend, a conversation missing from the LRU
+    tier, e.g. after a restart, is restored from the journal once.
+    """
+
+    def __init__(self, backend=None, max_conversations: int = MAX_CONVERSATIONS,
+                 max_messages: int = MAX_MESSAGES_PER_CONVERSATION,
+                 ttl: float = MEMORY_TTL_SECONDS, journal=None):
+        self.backend = backend
+        self.journal = journal
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._cache = LRUCache(maxsize=max_conversations, ttl=ttl)
+
+    async def get(self, user_id, role: str) -> list:
+        key = (user_id, role)
+        cached = self._cache.get(key)
+        if self.backend is None:
+            if cached is None:
+                cached = (0, await self._restore(user_id, role))
+                self._cache.set(key, cached)
+            return list(cached[1])
+
+        known_version = cached[0] if cached else None
+        version, messages = await asyncio.to_thread(self.backend.load, user_id, role, known_version)
+        if version is None:
+            self._cache.pop(key)
+            return []
+        if messages is None:
+            messages = cached[1]
+        self._cache.set(key, (version, messages))
+        return list(messages)
+
+    async def append(self, user_id, role: str, *messages: Turn):
+        key = (user_id, role)
+        if self.backend is not None:
+            version, history = await _finish_in_thread(
+                self.backend.append, user_id, role, messages, self.max_messages
+            )
+        else:
+            cached = self._cache.get(key)
+            version, history = cached if cached else (0, [])
+            history = (history + list(messages))[-self.max_messages:]
+            version += 1
+        self._cache.set(key, (version, history))
+        if self.journal is not None:
+            self.journal.record(user_id, role, messages)
+
+    async def _restore(self, user_id, role: str) -> list:
+        if self.journal is None:
+            return []
+        return await self.journal.recent(user_id, role, self.max_messages, self.ttl)
+
+    async def clear(self, user_id, role: str = None):
+        # Closed first, so a restore racing with the clear cannot read it back
+        if self.journal is not None:
+            await self.journal.close(user_id, role)
+        roles = [role] if role else [r for (uid, r) in self._cache.keys() if uid == user_id]
+        for r in roles:
+            self._cache.pop((user_id, r))
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.delete, user_id, role)
+
+
+def create_store() -> ConversationStore:
+    if MEMORY_BACKEND == "sqlite":
+        return ConversationStore(
+            backend=SQLiteBackend(MEMORY_SQLITE_PATH, MEMORY_TTL_SECONDS), journal=transcript_log
+        )
+    if MEMORY_BACKEND != "memory":
+        raise ValueError(f"Unknown CHAT_MEMORY_BACKEND: {MEMORY_BACKEND}")
+    return ConversationStore(journal=transcript_log)
+
+
+conversation_store = create_store()
+register_caches({"conversation": conversation_store._cache})
@@ -0,0 +1,166 @@
+import hashlib
+import hmac
+import os
+import secrets
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select, update
+from app.cache import LRUCache
+from app.database import SessionLocal
+from app.metrics import register_counters
+from app.models import OneTimeCode
+
+# "memory" keeps codes in this process (a single worker only, since the
+# verify request must land on the worker that issued the code); "database"
+# shares them between all workers and hosts through the one_time_codes table.
+OTP_BACKEND = os.getenv("OTP_BACKEND", "database")
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "300"))
+# Wrong guesses allowed per code before it is burned
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+OTP_MAX_PENDING = int(os.getenv("OTP_MAX_PENDING", "100000"))
+
+# consume() results
+VERIFIED = "verified"
+INVALID = "invalid"
+EXPIRED = "expired"
+LOCKED = "locked"
+MISSING = "missing"
+
+
+def generate_code() -> str:
+    return f"{secrets.randbelow(1000000):06d}"
+
+
+def _hash(email: str, code: str) -> str:
+    # Codes are not stored in the clear; the email is mixed in so equal
+    # codes for different addresses do not hash alike.
+    return hashlib.sha256(f"{email.lower()}:{code}".encode()).hexdigest()
+
+
+class MemoryOTPBackend:
+    """
+    Codes for a single process. The event loop never switches inside a
+    method, so every compare-and-consume is atomic. Entries carry their own
+    TTL in the LRU and expire lazily, no sweeper needed.
+    """
+
+    def __init__(self, max_pending: int = OTP_MAX_PENDING):
+        self._codes = LRUCache(maxsize=max_pending)
+
+    async def issue(self, email: str, code_hash: str, ttl: float):
+        # [hash, attempts, expires_at]; the absolute expiry tells EXPIRED apart
+        # from MISSING until the LRU drops the entry a little later.
+        self._codes.set(email, [code_hash, 0, datetime.now() + timedelta(seconds=ttl)], ttl=ttl * 2)
+
+    async def consume(self, email: str, code_hash: str, max_attempts: int) -> str:
+        entry = self._codes.get(email)
+        if entry is None:
+            return MISSING
+        if entry[2] <= datetime.now():
+            self._codes.pop(email)
+            return EXPIRED
+        if entry[1] >= max_attempts:
+            return LOCKED
+        if hmac.compare_digest(entry[0], code_hash):
+            self._codes.pop(email)
+            return VERIFIED
+        entry[1] += 1
+        return INVALID
+
+
+class DatabaseOTPBackend:
+    """
+    Codes in the shared one_time_codes table. Consuming is a single
+    conditional DELETE, so when concurrent verifies race exactly one of them
+    sees a deleted row; a wrong code is one conditional UPDATE of the
+    attempt counter. Only failures pay for the extra read that explains why.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+
+    async def issue(self, email: str, code_hash: str, ttl: float):
+        values = {
+            "email": email,
+            "code_hash": code_hash,
+            "attempts": 0,
+            "expires_at": datetime.now() + timedelta(seconds=ttl),
+        }
+        async with self.session_factory() as db:
+            await db.execute(_upsert(db.bind.dialect.name, values))
+            await db.commit()
+
+    async def consume(self, email: str, code_hash: str, max_attempts: int) -> str:
+        now = datetime.now()
+        live = (
+            OneTimeCode.email == email,
+            OneTimeCode.expires_at > now,
+            OneTimeCode.attempts < max_attempts,
+        )
+        async with self.session_factory() as db:
+            consumed = await db.execute(delete(OneTimeCode).where(*live, OneTimeCode.code_hash == code_hash))
+            if consumed.rowcount:
+                await db.commit()
+                return VERIFIED
+            counted = await db.execute(
+                update(OneTimeCode).where(*live).values(attempts=OneTimeCode.attempts + 1)
+            )
+            await db.commit()
+            if counted.rowcount:
+                return INVALID
+            row = (await db.execute(
+                select(OneTimeCode.expires_at).where(OneTimeCode.email == email)
+            )).first()
+        if row is None:
+            return MISSING
+        return EXPIRED if row.expires_at <= now else LOCKED
+
+
+def _upsert(dialect: str, values: dict):
+    """Replaces any pending code for the address in one statement."""
+    replace = {key: values[key] for key in ("code_hash", "attempts", "expires_at")}
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        return mysql_insert(OneTimeCode).values(**values).on_duplicate_key_update(**replace)
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(OneTimeCode).values(**values).on_conflict_do_update(
+            index_elements=[OneTimeCode.email], set_=replace
+        )
+    return insert(OneTimeCode).values(**values)
+
+
+class OTPStore:
+    """
+    One-time login codes with a TTL and a cap on wrong guesses. A new code
+    for an address replaces the pending one and resets its attempts.
+    """
+
+    def __init__(self, backend, ttl: float = OTP_TTL_SECONDS, max_attempts: int = OTP_MAX_ATTEMPTS):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.metrics = {"issued": 0, VERIFIED: 0, INVALID: 0, EXPIRED: 0, LOCKED: 0, MISSING: 0}
+
+    async def issue(self, email: str) -> str:
+        code = generate_code()
+        await self.backend.issue(email.lower(), _hash(email, code), self.ttl)
+        self.metrics["issued"] += 1
+        return code
+
+    async def consume(self, email: str, code: str) -> str:
+        """Returns VERIFIED (the code is used up), INVALID, EXPIRED, LOCKED or MISSING."""
+        result = await self.backend.consume(email.lower(), _hash(email, code.strip()), self.max_attempts)
+        self.metrics[result] += 1
+        return result
+
+
+def create_store() -> OTPStore:
+    if OTP_BACKEND == "database":
+        return OTPStore(DatabaseOTPBackend())
+    if OTP_BACKEND != "memory":
+        raise ValueError(f"Unknown OTP_BACKEND: {OTP_BACKEND}")
+    return OTPStore(MemoryOTPBackend())
+
+
+otp_store = create_store()
+register_counters("otp", lambda: otp_store.metrics)
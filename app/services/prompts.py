@@ -0,0 +1,62 @@
+from typing import NamedTuple
+from app.services.tokens import count_tokens
+
+USER = "user"
+ASSISTANT = "assistant"
+
+# How turns are labelled when a provider takes the conversation as plain text
+TRANSCRIPT_LABELS = {USER: "User: ", ASSISTANT: "AI: "}
+
+
+class Turn(NamedTuple):
+    """
+    One stored conversation message. The token count is computed once, when
+    the message is stored, instead of on every request that replays it.
+    """
+    role: str
+    content: str
+    tokens: int
+
+
+def user_turn(content: str) -> Turn:
+    return Turn(USER, content, count_tokens(content))
+
+
+def assistant_turn(content: str) -> Turn:
+    return Turn(ASSISTANT, content, count_tokens(content))
+
+
+def decode_turn(row) -> Turn:
+    # Rows written before turns were structured are ["User: ...", tokens]
+    if len(row) == 2:
+        text, tokens = row
+        for role, label in TRANSCRIPT_LABELS.items():
+            if text.startswith(label):
+                return Turn(role, text[len(label):], tokens)
+        return Turn(USER, text, tokens)
+    return Turn(*row)
+
+
+def chat_messages(system_message: dict, window: list, user_message: str) -> list:
+    """
+    OpenAI-style message list. `system_message` is a prebuilt dict shared by
+    every request for the role, so the prompt prefix is byte-for-byte the
+    same each time and providers can reuse their cached prefix.
+    """
+    messages = [system_message]
+    messages.extend({"role": turn.role, "content": turn.content} for turn in window)
+    messages.append({"role": USER, "content": user_message})
+    return messages
+
+
+def transcript(prefix: str, window: list, user_message: str, suffix: str = "") -> str:
+    """Single-string prompt: the fixed `prefix`, then the labelled turns."""
+    parts = [prefix]
+    for turn in window:
+        parts.append(TRANSCRIPT_LABELS[turn.role])
+        parts.append(turn.content)
+        parts.append("\n")
+    parts.append(TRANSCRIPT_LABELS[USER])
+    parts.append(user_message)
+    parts.append(suffix)
+    return "".join(parts)
@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from app.schemas.chat import ChatUsage
+from app.services import groq_service
+from app.services.response_cache import normalize_prompt
+
+# Fire the next provider when the first one has not answered after this many
+# milliseconds. 0 disables hedging.
+HEDGE_AFTER_MS = int(os.getenv("ROUTER_HEDGE_AFTER_MS", "0"))
+# How many recent calls the latency/error statistics look at
+STATS_WINDOW = int(os.getenv("ROUTER_STATS_WINDOW", "100"))
+# A provider is skipped while its recent error rate is above this
+MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+# How long a provider is benched after a rate limit or repeated failures
+COOLDOWN_SECONDS = float(os.getenv("ROUTER_COOLDOWN_SECONDS", "30"))
+MAX_CONSECUTIVE_FAILURES = 3
+# Items of one batch answered at the same time, and the largest batch accepted
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+
+log = logging.getLogger(__name__)
+
+LIMIT_REACHED_REPLY = "AI service limit reached. Please try again later."
+ERROR_REPLY = "Something went wrong. Please try again."
+
+
+def is_rate_limit(error: Exception) -> bool:
+    # groq.RateLimitError has status_code, google.genai ClientError has code
+    return 429 in (getattr(error, "status_code", None), getattr(error, "code", None))
+
+
+def error_reply(error: Exception) -> str:
+    return LIMIT_REACHED_REPLY if is_rate_limit(error) else ERROR_REPLY
+
+
+class Provider:
+    """One LLM backend plus its rolling latency and error statistics."""
+
+    def __init__(self, name: str, respond, stream, remember, load=None):
+        self.name = name
+        self.respond = respond
+        self.stream = stream
+        self.remember = remember
+        # Builds the SDK client ahead of the first request, see preload()
+        self.load = load
+        self.latencies = deque(maxlen=STATS_WINDOW)
+        self.first_token_latencies = deque(maxlen=STATS_WINDOW)
+        self.outcomes = deque(maxlen=STATS_WINDOW)
+        self.consecutive_failures = 0
+        self.benched_until = 0.0
+
+    def record_success(self, latency: float, first_token: bool = False):
+        (self.first_token_latencies if first_token else self.latencies).append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+
+    def record_failure(self, error: Exception):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if is_rate_limit(error) or self.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+            # Our own admission controller knows exactly when budget frees up
+            cooldown = getattr(error, "retry_after", None) or COOLDOWN_SECONDS
+            self.benched_until = time.monotonic() + min(cooldown, COOLDOWN_SECONDS)
+
+    def percentile(self, q: float, first_token: bool = False) -> float:
+        samples = self.first_token_latencies if first_token else self.latencies
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.benched_until and self.error_rate <= MAX_ERROR_RATE
+
+    def stats(self) -> dict:
+        return {
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "first_token_p50": self.percentile(0.5, first_token=True),
+            "first_token_p95": self.percentile(0.95, first_token=True),
+            "error_rate": self.error_rate,
+            "healthy": self.healthy,
+        }
+
+
+class ProviderRouter:
+    """
+    Sends each chat to the fastest healthy provider and fails over to the
+    others on errors or rate limits. With hedging enabled, a request that is
+    still pending after HEDGE_AFTER_MS is also sent to the next provider and
+    the first reply wins.
+    """
+
+    def __init__(self, providers: list, hedge_after_ms: int = HEDGE_AFTER_MS):
+        self.providers = {p.name: p for p in providers}
+        self.hedge_after = hedge_after_ms / 1000
+        self._turn = 0
+
+    def order(self, preferred: str = None, first_token: bool = False) -> list:
+        """
+        Healthy providers by p50 latency (providers without samples first, so
+        they get measured), then unhealthy ones as a last resort. A preferred
+        provider goes first among the healthy ones.
+        """
+        return sorted(
+            self.providers.values(),
+            key=lambda p: (not p.healthy, p.name != preferred, p.percentile(0.5, first_token)),
+        )
+
+    async def _call(self, provider: Provider, user_message: str, role: str, user_id, use_history: bool):
+        start = time.perf_counter()
+        try:
+            result = await provider.respond(
+                user_message, role, user_id, save_history=False, raise_errors=True, use_history=use_history
+            )
+        except Exception as e:
+            provider.record_failure(e)
+            raise
+        provider.record_success(time.perf_counter() - start)
+        return provider, result
+
+    async def get_response(self, user_message: str, role: str, user_id, preferred: str = None,
+                           use_history: bool = True, raise_errors: bool = False):
+        """
+        Returns (reply, input words, output words). Failures become a canned
+        reply, unless raise_errors is set, then the last error propagates.
+        With use_history=False the message is answered on its own and not
+        remembered.
+        """
+        candidates = self.order(preferred)
+        pending = set()
+        errors = []
+
+        try:
+            while candidates or pending:
+                if candidates:
+                    provider = candidates.pop(0)
+                    pending.add(asyncio.create_task(
+                        self._call(provider, user_message, role, user_id, use_history)
+                    ))
+
+                # Wait for a result; give up waiting after the hedge delay
+                # only while there is still a provider left to hedge with.
+                timeout = self.hedge_after if self.hedge_after and candidates else None
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    winner, (reply, in_w, out_w) = task.result()
+                    if use_history:
+                        await winner.remember(user_id, user_message, role, reply)
+                    return reply, in_w, out_w
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if raise_errors and errors:
+            raise errors[-1]
+        in_w = groq_service.word_count(user_message)
+        if errors and all(is_rate_limit(e) for e in errors):
+            return LIMIT_REACHED_REPLY, in_w, 0
+        return ERROR_REPLY, in_w, 0
+
+    async def stream_response(self, user_message: str, role: str, user_id, preferred: str = None):
+        """
+        Streams from the first provider that produces a token. Failover is
+        only possible before that point; hedging does not apply to streams.
+        """
+        errors = []
+        for provider in self.order(preferred, first_token=True):
+            start = time.perf_counter()
+            stream = provider.stream(user_message, role, user_id, raise_errors=True)
+            try:
+                first = await stream.__anext__()
+            except Exception as e:
+                provider.record_failure(e)
+                errors.append(e)
+                continue
+
+            provider.record_success(time.perf_counter() - start, first_token=True)
+            try:
+                yield first
+                async for item in stream:
+                    yield item
+            finally:
+                await stream.aclose()
+            return
+
+        yield LIMIT_REACHED_REPLY if errors and all(is_rate_limit(e) for e in errors) else ERROR_REPLY
+        yield ChatUsage(input_words=groq_service.word_count(user_message), output_words=0)
+
+    def _next_provider(self) -> str:
+        # Round robin over the healthy providers, so a batch draws on every
+        # provider's rate limit instead of queueing behind the fastest one
+        healthy = [p.name for p in self.providers.values() if p.healthy] or list(self.providers)
+        self._turn += 1
+        return healthy[self._turn % len(healthy)]
+
+    async def batch(self, requests: list, user_id, concurrency: int = BATCH_CONCURRENCY, admit=None):
+        """
+        Answers many independent requests, each a (message, role, preferred
+        provider) tuple, with at most `concurrency` in flight. Items without a
+        preferred provider are spread over the providers, and failover still
+        applies per item. Requests that only differ in case, spacing or
+        trailing punctuation are sent once.
+
+        Yields (index, (reply, input words, output words), None) or
+        (index, None, error) in completion order. `admit`, when given, is
+        awaited before each upstream call (the caller's per-user quota).
+        Items are answered without conversation history and not remembered.
+        """
+        indices = {}
+        for index, (message, role, preferred) in enumerate(requests):
+            indices.setdefault((normalize_prompt(message), role, preferred), []).append(index)
+
+        slots = asyncio.Semaphore(concurrency)
+
+        async def run(key):
+            message, role, preferred = requests[indices[key][0]]
+            async with slots:
+                if admit is not None:
+                    await admit()
+                return await self.get_response(
+                    message, role, user_id, preferred=preferred or self._next_provider(),
+                    use_history=False, raise_errors=True,
+                )
+
+        tasks = {asyncio.create_task(run(key)): key for key in indices}
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    for index in indices[tasks[task]]:
+                        yield index, None if error else task.result(), error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {name: p.stats() for name, p in self.providers.items()}
+
+    def preload(self):
+        """
+        Imports and builds every provider's client. Blocking, the lifespan
+        runs it in a worker thread so startup does not wait for it.
+        """
+        for provider in self.providers.values():
+            if provider.load is None:
+                continue
+            try:
+                provider.load()
+            except Exception as e:
+                log.warning("Could not preload %s client: %s", provider.name, e)
+
+
+def create_router() -> ProviderRouter:
+    providers = [
+        Provider("groq", groq_service.get_groq_response, groq_service.stream_groq_response,
+                 groq_service.remember, load=groq_service.get_client),
+    ]
+    # Optional providers are only imported when they are enabled
+    if os.getenv("GEMINI_API_KEY"):
+        from app.services import gemini_service
+        providers.append(
+            Provider("gemini", gemini_service.get_gemini_response, gemini_service.stream_gemini_response,
+                     gemini_service.remember, load=gemini_service.get_client)
+        )
+    return ProviderRouter(providers)
+
+
+provider_router = create_router()
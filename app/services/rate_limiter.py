@@ -0,0 +1,236 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from app.metrics import register_counters
+
+# "memory" limits each worker on its own; "sqlite" shares the buckets between
+# the workers on this host so together they stay under the provider limits.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "rate_limits.sqlite3")
+# How long a request may queue for budget before it is shed
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "2.0"))
+
+# Requests and tokens per minute per (provider, model)
+PROVIDER_LIMITS = {
+    ("groq", "llama-3.3-70b-versatile"): (
+        int(os.getenv("GROQ_RPM", "30")),
+        int(os.getenv("GROQ_TPM", "12000")),
+    ),
+    ("gemini", "gemini-2.5-flash"): (
+        int(os.getenv("GEMINI_RPM", "10")),
+        int(os.getenv("GEMINI_TPM", "250000")),
+    ),
+}
+# Fair share: chat requests per minute a single user may send upstream
+USER_RPM = int(os.getenv("USER_RPM", "20"))
+
+
+class RateLimited(Exception):
+    """Raised when a request is shed before reaching the provider."""
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _level(buckets: dict, name, capacity, rate, now) -> float:
+    tokens, updated = buckets.get(name, (capacity, now))
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+def _take(buckets: dict, requests: list, now: float) -> float:
+    """
+    Atomically takes `amount` from every (name, capacity, rate, amount)
+    bucket. Returns 0 on success, otherwise the seconds until all of them
+    could be satisfied (and takes nothing).
+    """
+    levels = [_level(buckets, name, cap, rate, now) for name, cap, rate, _ in requests]
+    wait = max(
+        (min(amount, cap) - level) / rate
+        for level, (_, cap, rate, amount) in zip(levels, requests)
+    )
+    if wait > 0:
+        return wait
+    for level, (name, _, _, amount) in zip(levels, requests):
+        buckets[name] = (level - amount, now)
+    return 0.0
+
+
+def _charge(buckets: dict, name, capacity, rate, amount, now: float):
+    # Unconditional debit, the bucket may go negative and delay later requests
+    buckets[name] = (_level(buckets, name, capacity, rate, now) - amount, now)
+
+
+class MemoryBucketStore:
+    """
+    Token buckets for a single process. A full bucket behaves like a missing
+    one, so buckets that have refilled (users gone quiet) are dropped every
+    `prune_every` operations and the store only holds recently active users.
+    """
+    blocking = False
+
+    def __init__(self, prune_every: int = 1000):
+        self.prune_every = prune_every
+        self._buckets = {}
+        # name -> (capacity, rate), to tell when a bucket has refilled
+        self._shapes = {}
+        self._ops = 0
+
+    def take(self, requests: list) -> float:
+        now = time.monotonic()
+        self._track([(name, cap, rate) for name, cap, rate, _ in requests], now)
+        return _take(self._buckets, requests, now)
+
+    def charge(self, name, capacity, rate, amount):
+        now = time.monotonic()
+        self._track([(name, capacity, rate)], now)
+        _charge(self._buckets, name, capacity, rate, amount, now)
+
+    def _track(self, shapes: list, now: float):
+        # Prune first, so the buckets about to be written keep their shape
+        self._ops += 1
+        if self._ops % self.prune_every == 0:
+            for name, (capacity, rate) in list(self._shapes.items()):
+                if _level(self._buckets, name, capacity, rate, now) >= capacity:
+                    self._buckets.pop(name, None)
+                    del self._shapes[name]
+        for name, capacity, rate in shapes:
+            self._shapes[name] = (capacity, rate)
+
+
+class SQLiteBucketStore:
+    """
+    Token buckets shared by all workers through a local SQLite file. Uses
+    wall-clock time since monotonic clocks are not comparable across
+    processes.
+    """
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, names: list, func):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT name, tokens, updated FROM buckets WHERE name IN ({','.join('?' * len(names))})",
+                names,
+            ).fetchall()
+            buckets = {name: (tokens, updated) for name, tokens, updated in rows}
+            result = func(buckets)
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                [(name, *buckets[name]) for name in names if name in buckets],
+            )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def take(self, requests: list) -> float:
+        names = [r[0] for r in requests]
+        return self._transaction(names, lambda buckets: _take(buckets, requests, time.time()))
+
+    def charge(self, name, capacity, rate, amount):
+        self._transaction(
+            [name], lambda buckets: _charge(buckets, name, capacity, rate, amount, time.time())
+        )
+
+
+class AdmissionController:
+    """
+    Keeps upstream traffic inside each provider's requests-per-minute and
+    tokens-per-minute limits. Requests queue for up to RATE_LIMIT_MAX_WAIT
+    seconds for budget and are shed with RateLimited after that, so we run
+    at the limit instead of bouncing off provider 429s.
+    """
+
+    def __init__(self, store, limits: dict = PROVIDER_LIMITS, user_rpm: int = USER_RPM,
+                 max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.store = store
+        self.limits = limits
+        self.user_rpm = user_rpm
+        self.max_wait = max_wait
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+
+    async def _call(self, func, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def _acquire(self, requests: list, what: str):
+        deadline = time.monotonic() + self.max_wait
+        waited = False
+        while True:
+            wait = await self._call(self.store.take, requests)
+            if wait <= 0:
+                self.admitted += 1
+                return
+            if time.monotonic() + wait > deadline:
+                self.shed += 1
+                raise RateLimited(f"{what} rate limit reached", retry_after=wait)
+            if not waited:
+                self.queued += 1
+                waited = True
+            await asyncio.sleep(wait)
+
+    def _provider_buckets(self, provider: str, model: str, tokens: int) -> list:
+        rpm, tpm = self.limits[(provider, model)]
+        return [
+            (f"{provider}:{model}:rpm", rpm, rpm / 60, 1),
+            (f"{provider}:{model}:tpm", tpm, tpm / 60, tokens),
+        ]
+
+    async def admit(self, provider: str, model: str, prompt_tokens: int):
+        """Waits for budget for one request with `prompt_tokens` input tokens."""
+        if (provider, model) not in self.limits:
+            return
+        await self._acquire(self._provider_buckets(provider, model, prompt_tokens), provider)
+
+    async def settle(self, provider: str, model: str, output_tokens: int):
+        """Charges the reply tokens, which are only known once it is done."""
+        if (provider, model) not in self.limits or not output_tokens:
+            return
+        _, tpm = self.limits[(provider, model)]
+        await self._call(self.store.charge, f"{provider}:{model}:tpm", tpm, tpm / 60, output_tokens)
+
+    async def admit_user(self, user_id):
+        """Per-user fair share, so one heavy user cannot drain the provider budget."""
+        if self.user_rpm <= 0:
+            return
+        await self._acquire([(f"user:{user_id}:rpm", self.user_rpm, self.user_rpm / 60, 1)], "User")
+
+    def stats(self) -> dict:
+        return {"admitted": self.admitted, "queued": self.queued, "shed": self.shed}
+
+
+def create_controller() -> AdmissionController:
+    if RATE_LIMIT_BACKEND == "sqlite":
+        return AdmissionController(SQLiteBucketStore(RATE_LIMIT_SQLITE_PATH))
+    if RATE_LIMIT_BACKEND != "memory":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND}")
+    return AdmissionController(MemoryBucketStore())
+
+
+admission = create_controller()
+register_counters("admission", admission.stats)
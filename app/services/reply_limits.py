@@ -0,0 +1,230 @@
+import math
+import os
+import re
+from collections import deque
+from app.metrics import LLM_REPLY_CUTOFFS, REGISTRY
+
+# Output budgets (max_tokens) are learned per provider and role: the
+# OUTPUT_BUDGET_PERCENTILE of the last OUTPUT_BUDGET_WINDOW reply lengths,
+# times OUTPUT_BUDGET_HEADROOM. Until OUTPUT_BUDGET_MIN_SAMPLES replies have
+# been seen the role default applies.
+OUTPUT_BUDGET_PERCENTILE = float(os.getenv("OUTPUT_BUDGET_PERCENTILE", "0.99"))
+OUTPUT_BUDGET_HEADROOM = float(os.getenv("OUTPUT_BUDGET_HEADROOM", "1.25"))
+OUTPUT_BUDGET_WINDOW = int(os.getenv("OUTPUT_BUDGET_WINDOW", "1000"))
+OUTPUT_BUDGET_MIN_SAMPLES = int(os.getenv("OUTPUT_BUDGET_MIN_SAMPLES", "50"))
+OUTPUT_BUDGET_FLOOR = int(os.getenv("OUTPUT_BUDGET_FLOOR", "128"))
+OUTPUT_BUDGET_CEILING = int(os.getenv("OUTPUT_BUDGET_CEILING", "4096"))
+
+DEFAULT_OUTPUT_BUDGETS = {
+    "teacher": 1500,
+    "interviewer": 600,
+    "debugger": 1500,
+    None: 1000,
+}
+
+# Interviewer replies stop after this many questions unless the user asks
+# for a (smaller or larger, up to the cap) number.
+INTERVIEW_QUESTIONS = int(os.getenv("INTERVIEW_QUESTIONS", "10"))
+INTERVIEW_QUESTIONS_MAX = int(os.getenv("INTERVIEW_QUESTIONS_MAX", "25"))
+
+_REQUESTED_QUESTIONS = re.compile(r"\b(\d{1,3})\s+(?:[\w+#.-]+\s+){0,4}?questions?\b", re.IGNORECASE)
+
+
+def requested_questions(user_message: str) -> int:
+    match = _REQUESTED_QUESTIONS.search(user_message)
+    if match is None or int(match.group(1)) == 0:
+        return INTERVIEW_QUESTIONS
+    return min(int(match.group(1)), INTERVIEW_QUESTIONS_MAX)
+
+
+class NumberedListStop:
+    """Ends the reply before list item `limit + 1` starts."""
+    _item = re.compile(r"\s*\**(\d+)[.)]\s")
+    # A partial line that may still turn into an item number
+    _maybe_item = re.compile(r"\s*\**\d*[.)]?")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+
+    def cut_before(self, line: str) -> bool:
+        match = self._item.match(line)
+        return match is not None and int(match.group(1)) > self.limit
+
+    def cut_after(self, line: str) -> bool:
+        return False
+
+    def holds(self, partial: str) -> bool:
+        return self._maybe_item.fullmatch(partial) is not None
+
+
+class CorrectedCodeStop:
+    """
+    Ends the reply after the first code block that follows a mention of the
+    fix ("Corrected code:", "Here is the fixed version"), so a block quoting
+    the user's broken code does not end it.
+    """
+    # Whole words only: "incorrect" or "fix this" describe the broken code
+    _mention = re.compile(
+        r"\b(?:corrected|fixed|updated|revised|working)\b.*\b(?:code|version)\b", re.IGNORECASE
+    )
+
+    def __init__(self):
+        self.in_block = False
+        self.mentioned = False
+        self.block_is_fix = False
+
+    def cut_before(self, line: str) -> bool:
+        return False
+
+    def cut_after(self, line: str) -> bool:
+        if line.lstrip().startswith("```"):
+            if self.in_block:
+                self.in_block = False
+                self.mentioned = False
+                return self.block_is_fix
+            self.in_block = True
+            self.block_is_fix = self.mentioned
+        elif not self.in_block and self._mention.search(line):
+            self.mentioned = True
+        return False
+
+    def holds(self, partial: str) -> bool:
+        return False
+
+
+STOP_CONDITIONS = {
+    "interviewer": lambda user_message: NumberedListStop(requested_questions(user_message)),
+    "debugger": lambda user_message: CorrectedCodeStop(),
+}
+
+
+class ReplyLimit:
+    """
+    Output limits for one reply: `max_tokens` for the upstream call plus the
+    role's stop condition. Streamed text goes through feed(), which returns
+    what may be sent on and sets `stopped` once the reply is complete, at
+    which point the caller closes the upstream stream. A partial line that
+    could still trigger the stop condition is held back until it is decided.
+    """
+
+    def __init__(self, budgets, provider: str, role: str, max_tokens: int, stop=None):
+        self.budgets = budgets
+        self.provider = provider
+        self.role = role
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.stopped = False
+        self.truncated = False
+        self._text = ""
+        self._sent = 0
+        self._line_start = 0
+
+    def feed(self, text: str) -> str:
+        if self.stopped:
+            return ""
+        if self.stop is None:
+            return text
+        self._text += text
+        cut = self._scan()
+        if cut is not None:
+            self.stopped = True
+            LLM_REPLY_CUTOFFS.labels(self.provider, self.role, "stop").inc()
+            return self._take(cut)
+        partial = self._text[self._line_start:]
+        if partial and self.stop.holds(partial):
+            return self._take(self._line_start)
+        return self._take(len(self._text))
+
+    def flush(self) -> str:
+        """Whatever is still held back once the upstream reply has ended."""
+        if self.stopped or self.stop is None:
+            return ""
+        partial = self._text[self._line_start:]
+        if partial and self.stop.cut_before(partial):
+            return self._take(self._line_start).rstrip()
+        return self._take(len(self._text))
+
+    def _scan(self):
+        while True:
+            end = self._text.find("\n", self._line_start)
+            line = self._text[self._line_start:] if end < 0 else self._text[self._line_start:end]
+            if self.stop.cut_before(line):
+                return self._line_start
+            if end < 0:
+                return None
+            self._line_start = end + 1
+            if self.stop.cut_after(line):
+                return end
+
+    def _take(self, end: int) -> str:
+        out = self._text[self._sent:end]
+        self._sent = max(self._sent, end)
+        return out
+
+    def finish(self, output_tokens: int, truncated: bool = False):
+        """Records the reply length; `truncated` when it ran into max_tokens."""
+        self.truncated = truncated
+        if truncated:
+            LLM_REPLY_CUTOFFS.labels(self.provider, self.role, "budget").inc()
+        self.budgets.observe(self.provider, self.role, output_tokens, truncated, self.max_tokens)
+
+
+class OutputBudgets:
+    """
+    Learned max_tokens per (provider, role). A reply that ran into its budget
+    is recorded at twice the budget, so roles that keep hitting the limit
+    grow it quickly instead of settling on truncated lengths.
+    """
+
+    def __init__(self, defaults: dict = DEFAULT_OUTPUT_BUDGETS, window: int = OUTPUT_BUDGET_WINDOW,
+                 min_samples: int = OUTPUT_BUDGET_MIN_SAMPLES, percentile: float = OUTPUT_BUDGET_PERCENTILE,
+                 headroom: float = OUTPUT_BUDGET_HEADROOM, floor: int = OUTPUT_BUDGET_FLOOR,
+                 ceiling: int = OUTPUT_BUDGET_CEILING):
+        self.defaults = defaults
+        self.window = window
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.headroom = headroom
+        self.floor = floor
+        self.ceiling = ceiling
+        self._samples = {}
+        self._observed = {}
+        self._budgets = {}
+
+    def budget(self, provider: str, role: str) -> int:
+        budget = self._budgets.get((provider, role))
+        if budget is None:
+            budget = self.defaults.get(role, self.defaults[None])
+        return budget
+
+    def observe(self, provider: str, role: str, output_tokens: int, truncated: bool, max_tokens: int):
+        key = (provider, role)
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(min(max_tokens * 2, self.ceiling) if truncated else output_tokens)
+        # Re-derived every 10th reply, the percentile moves slowly anyway; the
+        # window stops growing once full, so count the replies separately
+        observed = self._observed[key] = self._observed.get(key, 0) + 1
+        if len(samples) >= self.min_samples and observed % 10 == 0:
+            ordered = sorted(samples)
+            p = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+            self._budgets[key] = max(self.floor, min(self.ceiling, math.ceil(p * self.headroom)))
+
+    def limit(self, provider: str, role: str, user_message: str) -> ReplyLimit:
+        make_stop = STOP_CONDITIONS.get(role)
+        return ReplyLimit(
+            self, provider, role, self.budget(provider, role),
+            make_stop(user_message) if make_stop else None,
+        )
+
+    def collect(self):
+        keys = sorted(set(self._samples) | set(self._budgets), key=str)
+        return [
+            ("llm_output_token_budget", "gauge", "Current max_tokens per provider and role.",
+             [({"provider": p, "role": str(r)}, self.budget(p, r)) for p, r in keys]),
+        ]
+
+
+output_budgets = OutputBudgets()
+REGISTRY.add_collector(output_budgets.collect)
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from app.cache import LRUCache
+from app.metrics import register_caches
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Optional second tier that survives restarts and is shared by the workers
+RESPONSE_CACHE_DISK_PATH = os.getenv("RESPONSE_CACHE_DISK_PATH")
+
+log = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:]+$")
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Folds prompts that only differ in case, spacing, unicode form or
+    trailing punctuation onto the same cache key.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _WHITESPACE.sub(" ", text).strip()
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+def history_hash(history: list) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for turn in history:
+        digest.update(turn.role.encode("ascii"))
+        digest.update(b":")
+        digest.update(turn.content.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskTier:
+    """
+    SQLite-backed cache tier, read only on in-memory misses. Its methods
+    block; ResponseCache runs them in a thread.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, reply TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        row = self._connect().execute(
+            "SELECT reply, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        return row
+
+    def set(self, key: str, reply: str, ttl: float):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, reply, expires_at) VALUES (?, ?, ?)",
+            (key, reply, time.time() + ttl),
+        )
+        self._writes += 1
+        if self._writes % 200 == 0:
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM responses WHERE key NOT IN"
+                " (SELECT key FROM responses ORDER BY expires_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+
+class ResponseCache:
+    """
+    Caches LLM replies keyed by (provider, model, role, normalized prompt,
+    history hash). Memory tier first, then the optional disk tier, which is
+    read in a thread and written behind, so a busy cache file never holds
+    up the event loop.
+    """
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 disk_path: str = RESPONSE_CACHE_DISK_PATH,
+                 enabled: bool = RESPONSE_CACHE_ENABLED):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.memory = LRUCache(
+            maxsize=max_entries, ttl=ttl, max_bytes=max_bytes,
+            sizeof=lambda reply: len(reply.encode("utf-8")),
+        )
+        self.disk = DiskTier(disk_path, max_entries * 10) if disk_path and enabled else None
+        self.disk_hits = 0
+        self._disk_writes = set()
+
+    @staticmethod
+    def key(provider: str, model: str, role: str, prompt: str, history: list = ()) -> str:
+        raw = "\0".join((provider, model, role, normalize_prompt(prompt), history_hash(history)))
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=20).hexdigest()
+
+    async def get(self, key: str):
+        if not self.enabled:
+            return None
+        reply = self.memory.get(key)
+        if reply is not None or self.disk is None:
+            return reply
+
+        try:
+            row = await asyncio.to_thread(self.disk.get, key)
+        except sqlite3.Error as e:
+            log.error("Response cache read failed: %s", e)
+            return None
+        if row is None:
+            return None
+        reply, expires_at = row
+        self.disk_hits += 1
+        self.memory.set(key, reply, ttl=max(expires_at - time.time(), 1))
+        return reply
+
+    def set(self, key: str, reply: str):
+        if not self.enabled or not reply:
+            return
+        self.memory.set(key, reply)
+        if self.disk is not None:
+            task = asyncio.ensure_future(asyncio.to_thread(self.disk.set, key, reply, self.ttl))
+            self._disk_writes.add(task)
+            task.add_done_callback(self._disk_written)
+
+    def _disk_written(self, task: asyncio.Future):
+        self._disk_writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Response cache write failed: %s", task.exception())
+
+    def stats(self) -> dict:
+        lookups = self.memory.hits + self.memory.misses
+        return {
+            "entries": len(self.memory),
+            "bytes": self.memory.bytes,
+            "hits": self.memory.hits + self.disk_hits,
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.memory.misses - self.disk_hits,
+            "evictions": self.memory.evictions,
+            "hit_rate": (self.memory.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache()
+register_caches({"response": response_cache.memory})
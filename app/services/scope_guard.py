@@ -0,0 +1,66 @@
+import re
+
+# Topic categories and the phrases that put a message in them. Phrases match
+# on word boundaries, so "ai" no longer matches inside "said" or "email".
+TOPIC_PATTERNS = {
+    "python": [r"python\w*"],
+    "ai": [r"ai", r"artificial\s+intelligence"],
+    "machine_learning": [r"machine\s+learning"],
+    "deep_learning": [r"deep\s+learning"],
+    "fastapi": [r"fastapi"],
+    "programming": [r"coding", r"programming"],
+}
+
+PYTHON_CODE_PATTERNS = [
+    r"\bprint\s*\(",
+    r"\bdef\s+\w+\(",
+    r"\bclass\s+\w+",
+    r"\bimport\s+\w+",
+    r"\bfor\s+\w+\s+in\s+",
+    r"\bif\s+.+:",
+]
+
+CODE = "python_code"
+
+# One alternation with a named group per category: a single scan of the
+# message finds every category instead of one substring scan per keyword.
+# Messages are lowercased up front instead of using IGNORECASE.
+_TOPICS = re.compile(
+    r"\b(?:"
+    + "|".join(f"(?P<{name}>{'|'.join(parts)})" for name, parts in TOPIC_PATTERNS.items())
+    + r")\b"
+)
+_CODE = re.compile("|".join(f"(?:{p})" for p in PYTHON_CODE_PATTERNS))
+
+
+def looks_like_python_code(message: str) -> bool:
+    return _CODE.search(message) is not None
+
+
+def classify(message: str) -> frozenset:
+    """Returns every topic category the message touches, plus CODE for code."""
+    categories = {match.lastgroup for match in _TOPICS.finditer(message.lower())}
+    if looks_like_python_code(message):
+        categories.add(CODE)
+    return frozenset(categories)
+
+
+class ScopeGuard:
+    """
+    Decides whether a message is in scope for a provider. `topics` are the
+    categories that make any message allowed; for `code_roles` a message
+    that looks like Python code is allowed as well.
+    """
+
+    def __init__(self, topics=tuple(TOPIC_PATTERNS), code_roles=("debugger",)):
+        self.topics = frozenset(topics)
+        self.code_roles = frozenset(code_roles)
+        # Only the allowed phrases, without groups: one search() call in C
+        # per message, stopping at the first hit
+        phrases = [part for name in sorted(self.topics) for part in TOPIC_PATTERNS[name]]
+        self._allowed = re.compile(rf"\b(?:{'|'.join(phrases)})\b") if phrases else None
+
+    def is_allowed(self, message: str, role: str) -> bool:
+        if role in self.code_roles and looks_like_python_code(message):
+            return True
+        return self._allowed is not None and self._allowed.search(message.lower()) is not None
@@ -0,0 +1,121 @@
+import asyncio
+from app.metrics import register_counters
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class _Broadcast:
+    """
+    Buffers the chunks of one upstream stream so any number of readers can
+    replay it from the start while it is still being produced.
+    """
+    __slots__ = ("chunks", "done", "error", "changed", "task", "readers")
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.task = None
+        self.readers = 0
+
+    async def pump(self, stream):
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError as e:
+            # A reader still attached must not take the cut-off text as a full reply
+            self.error = e
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def read(self):
+        i = 0
+        while True:
+            if i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self.changed.wait()
+
+
+class SingleFlight:
+    """
+    Collapses identical concurrent calls into one upstream request.
+
+    The first caller for a key starts the work; callers arriving while it is
+    in flight share its result (or stream). The work is cancelled only when
+    every waiter has gone away, and is forgotten at that moment, so a caller
+    arriving while it unwinds starts fresh instead of sharing a cut-off result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self.shared = 0
+
+    @staticmethod
+    def _forget(calls: dict, key, call):
+        if calls.get(key) is call:
+            del calls[key]
+
+    async def do(self, key, factory):
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+        else:
+            self.shared += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(self._calls, key, call)
+                call.task.cancel()
+
+    async def stream(self, key, factory):
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(broadcast.pump(factory()))
+            broadcast.task.add_done_callback(lambda _: self._forget(self._streams, key, broadcast))
+        else:
+            self.shared += 1
+
+        broadcast.readers += 1
+        try:
+            async for chunk in broadcast.read():
+                yield chunk
+        finally:
+            broadcast.readers -= 1
+            if broadcast.readers == 0 and not broadcast.task.done():
+                self._forget(self._streams, key, broadcast)
+                broadcast.task.cancel()
+
+
+inflight = SingleFlight()
+register_counters("singleflight", lambda: {"shared": inflight.shared})
@@ -0,0 +1,41 @@
+import json
+from typing import AsyncIterator, Union
+from app.schemas.chat import ChatUsage
+
+
+class WordCounter:
+    """
+    Counts words across streamed chunks without re-splitting the whole reply.
+    A word split over two chunks is only counted once.
+    """
+    __slots__ = ("count", "_in_word")
+
+    def __init__(self):
+        self.count = 0
+        self._in_word = False
+
+    def feed(self, chunk: str) -> None:
+        if not chunk:
+            return
+        words = len(chunk.split())
+        if self._in_word and not chunk[0].isspace():
+            words -= 1
+        self.count += max(words, 0)
+        self._in_word = not chunk[-1].isspace()
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def to_sse(stream: AsyncIterator[Union[str, ChatUsage]]) -> AsyncIterator[str]:
+    """
+    Turns a service token stream into Server-Sent Events:
+    one `data` event per token and a final `done` event with the usage.
+    """
+    async for item in stream:
+        if isinstance(item, ChatUsage):
+            yield sse_event(item.model_dump(), event="done")
+        else:
+            yield sse_event({"token": item})
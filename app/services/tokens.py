@@ -0,0 +1,40 @@
+import os
+import re
+
+# Prompt budget (system prompt + history + new message) per model, in tokens.
+# Well below the models' context windows on purpose: it is what bounds the
+# cost of a single request.
+PROMPT_TOKEN_BUDGETS = {
+    "llama-3.3-70b-versatile": int(os.getenv("GROQ_PROMPT_TOKEN_BUDGET", "6000")),
+    "gemini-2.5-flash": int(os.getenv("GEMINI_PROMPT_TOKEN_BUDGET", "8000")),
+}
+
+_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximates the BPE token count of `text` without loading a tokenizer:
+    every punctuation mark is a token and words cost one token per ~4 chars.
+    """
+    return sum((len(piece) + 3) // 4 for piece in _PIECES.findall(text))
+
+
+def fit_history(history: list, budget: int) -> list:
+    """
+    Returns the newest suffix of `history` (prompts.Turn records) whose
+    entries fit in `budget` tokens. Older turns are dropped first, and the
+    window never starts with an orphaned AI reply.
+    """
+    used = 0
+    start = len(history)
+    for i in range(len(history) - 1, -1, -1):
+        used += history[i].tokens
+        if used > budget:
+            break
+        start = i
+
+    window = history[start:]
+    if window and window[0].role == "assistant":
+        window = window[1:]
+    return window
@@ -0,0 +1,351 @@
+import asyncio
+import base64
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, insert, or_, select, update
+from app.database import SessionLocal
+from app.metrics import register_counters
+from app.models import Conversation, Message
+from app.services.prompts import Turn
+
+TRANSCRIPTS_ENABLED = os.getenv("TRANSCRIPTS_ENABLED", "true").lower() == "true"
+TRANSCRIPT_QUEUE_MAX = int(os.getenv("TRANSCRIPT_QUEUE_MAX", "10000"))
+# Upper bound on queued writes turned into one transaction / executemany
+TRANSCRIPT_BATCH_SIZE = int(os.getenv("TRANSCRIPT_BATCH_SIZE", "500"))
+TRANSCRIPT_RETRY_DELAY = float(os.getenv("TRANSCRIPT_RETRY_DELAY", "1.0"))
+# Tries per batch before its items are written one by one, and dropped if that fails too
+TRANSCRIPT_MAX_ATTEMPTS = int(os.getenv("TRANSCRIPT_MAX_ATTEMPTS", "5"))
+
+log = logging.getLogger(__name__)
+
+
+class _Append:
+    __slots__ = ("user_id", "role", "turns", "created_at")
+
+    def __init__(self, user_id, role, turns, created_at):
+        self.user_id = user_id
+        self.role = role
+        self.turns = turns
+        self.created_at = created_at
+
+
+class _Close:
+    __slots__ = ("user_id", "role", "closed_at")
+
+    def __init__(self, user_id, role, closed_at):
+        self.user_id = user_id
+        self.role = role
+        self.closed_at = closed_at
+
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{message_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Raises ValueError for cursors we did not hand out."""
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _open_conversation(user_id, role):
+    return (
+        select(Conversation.id)
+        .where(Conversation.user_id == user_id, Conversation.role == role, Conversation.closed_at.is_(None))
+        .order_by(Conversation.created_at.desc(), Conversation.id.desc())
+        .limit(1)
+    )
+
+
+def _conversation_at(user_id, role, at: datetime):
+    """The conversation that was open at `at`, even if it has been closed since."""
+    return (
+        select(Conversation.id, Conversation.created_at, Conversation.closed_at)
+        .where(
+            Conversation.user_id == user_id,
+            Conversation.role == role,
+            Conversation.created_at <= at,
+            or_(Conversation.closed_at.is_(None), Conversation.closed_at > at),
+        )
+        .order_by(Conversation.created_at.desc(), Conversation.id.desc())
+        .limit(1)
+    )
+
+
+class TranscriptLog:
+    """
+    Durable chat transcripts with write-behind inserts.
+
+    Requests only enqueue; a background writer drains the queue and turns
+    everything pending into one transaction with a single executemany
+    insert, so chat latency does not depend on the database. Writes that
+    fail are retried in order, a few times with backoff; a batch that keeps
+    failing is then written item by item so one bad row only loses itself.
+    stop() flushes the queue on shutdown.
+
+    Messages go to the conversation that was open when they were recorded,
+    looked up in the database rather than cached per process, so a /clear
+    on one worker is seen by the others and by writes still queued here.
+    """
+
+    def __init__(self, queue_max: int = TRANSCRIPT_QUEUE_MAX, batch_size: int = TRANSCRIPT_BATCH_SIZE):
+        self.queue_max = queue_max
+        self.batch_size = batch_size
+        self.queue = None
+        self._task = None
+        # (user id, role) -> appends queued but not yet committed, oldest first
+        self._pending = {}
+        # Bumped after every committed batch
+        self._generation = 0
+        self.metrics = {
+            "recorded": 0,
+            "dropped": 0,
+            "written": 0,
+            "batches": 0,
+            "write_errors": 0,
+            "write_seconds": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if not TRANSCRIPTS_ENABLED:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_max)
+        self._task = asyncio.create_task(self._writer())
+
+    async def stop(self, timeout: float = 5.0):
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Transcript queue not drained on shutdown, %d writes dropped", self.queue.qsize())
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def _put(self, item) -> bool:
+        if self._task is None:
+            return False
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # The database is down or far behind; never make chats wait on it
+            self.metrics["dropped"] += 1
+            return False
+        self.metrics["recorded"] += 1
+        return True
+
+    def record(self, user_id, role: str, turns):
+        item = _Append(user_id, role, turns, datetime.now())
+        if self._put(item):
+            self._pending.setdefault((user_id, role), deque()).append(item)
+
+    async def close(self, user_id, role: str = None):
+        """
+        Ends the open conversation(s), the next message starts a new one.
+        Written right away rather than queued, so a restore that follows
+        cannot read the conversation back; messages still queued from before
+        land in the closed conversation.
+        """
+        if self._task is None:
+            return
+        item = _Close(user_id, role, datetime.now())
+        try:
+            async with SessionLocal() as db:
+                await self._close(db, item)
+                await db.commit()
+        except Exception as e:
+            log.error("Error closing conversation, queued for retry: %s", e)
+            self._put(item)
+
+    async def recent(self, user_id, role: str, limit: int, max_age: float) -> list:
+        """
+        The last `limit` turns of the open conversation that are younger than
+        `max_age` seconds. Used to restore memory after a restart. Never waits
+        for the writer: turns still queued here are added from memory.
+        """
+        if self._task is None:
+            return []
+        since = datetime.now() - timedelta(seconds=max_age)
+        try:
+            async with SessionLocal() as db:
+                # A batch committed during the read may be in neither the
+                # rows nor the pending turns; read again in that case
+                for _ in range(3):
+                    generation = self._generation
+                    rows, last_closed = await self._recent_rows(db, user_id, role, limit, since)
+                    if generation == self._generation:
+                        break
+        except Exception as e:
+            log.error("Error loading chat transcript: %s", e)
+            return []
+        turns = [Turn(*row) for row in reversed(rows)]
+        for item in self._pending.get((user_id, role), ()):
+            if item.created_at > since and (last_closed is None or item.created_at > last_closed):
+                turns.extend(item.turns)
+        return turns[-limit:]
+
+    async def _recent_rows(self, db, user_id, role: str, limit: int, since: datetime):
+        last_closed = await db.scalar(
+            select(func.max(Conversation.closed_at))
+            .where(Conversation.user_id == user_id, Conversation.role == role)
+        )
+        conversation_id = await db.scalar(_open_conversation(user_id, role))
+        if conversation_id is None:
+            return [], last_closed
+        rows = (await db.execute(
+            select(Message.sender, Message.content, Message.tokens)
+            .where(
+                Message.user_id == user_id,
+                Message.role == role,
+                Message.created_at > since,
+                Message.conversation_id == conversation_id,
+            )
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(limit)
+        )).all()
+        return rows, last_closed
+
+    async def _writer(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            start = time.perf_counter()
+            written = await self._write_retrying(batch)
+            if written is None:
+                written = await self._write_each(batch)
+            self.metrics["write_seconds"] += time.perf_counter() - start
+            self.metrics["batches"] += 1
+            self.metrics["written"] += written
+            self._committed(batch)
+
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _write_retrying(self, batch: list):
+        """Rows written, or None once TRANSCRIPT_MAX_ATTEMPTS tries have failed."""
+        for attempt in range(TRANSCRIPT_MAX_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(min(TRANSCRIPT_RETRY_DELAY * 2 ** (attempt - 1), 30))
+            try:
+                return await self._write(batch)
+            except Exception as e:
+                self.metrics["write_errors"] += 1
+                log.error("Error writing chat transcripts: %s", e, extra={"attempt": attempt})
+        return None
+
+    async def _write_each(self, batch: list) -> int:
+        written = 0
+        for item in batch:
+            try:
+                written += await self._write([item])
+            except Exception as e:
+                self.metrics["write_errors"] += 1
+                self.metrics["dropped"] += 1
+                log.error("Dropping chat transcript write for user %s: %s", item.user_id, e)
+        return written
+
+    def _committed(self, batch: list):
+        for item in batch:
+            if isinstance(item, _Append):
+                pending = self._pending.get((item.user_id, item.role))
+                if pending:
+                    pending.popleft()
+                    if not pending:
+                        del self._pending[(item.user_id, item.role)]
+        self._generation += 1
+
+    async def _write(self, batch: list) -> int:
+        rows = []
+        # (user id, role) -> (id, created_at, closed_at) of the conversation
+        # the previous message went to, valid for this transaction only
+        conversations = {}
+        async with SessionLocal() as db:
+            for item in batch:
+                if isinstance(item, _Close):
+                    await self._close(db, item)
+                    conversations.clear()
+                    continue
+                conversation_id = await self._conversation_id(db, item, conversations)
+                rows.extend(
+                    {
+                        "conversation_id": conversation_id,
+                        "user_id": item.user_id,
+                        "role": item.role,
+                        "sender": turn.role,
+                        "content": turn.content,
+                        "tokens": turn.tokens,
+                        "created_at": item.created_at,
+                    }
+                    for turn in item.turns
+                )
+            if rows:
+                await db.execute(insert(Message), rows)
+            await db.commit()
+        return len(rows)
+
+    async def _close(self, db, item: _Close):
+        stmt = update(Conversation).where(
+            Conversation.user_id == item.user_id, Conversation.closed_at.is_(None)
+        )
+        if item.role is not None:
+            stmt = stmt.where(Conversation.role == item.role)
+        await db.execute(stmt.values(closed_at=item.closed_at))
+
+    async def _conversation_id(self, db, item: _Append, conversations: dict) -> int:
+        key = (item.user_id, item.role)
+        known = conversations.get(key)
+        if known is not None:
+            conversation_id, created_at, closed_at = known
+            if created_at <= item.created_at and (closed_at is None or closed_at > item.created_at):
+                return conversation_id
+        known = (await db.execute(_conversation_at(item.user_id, item.role, item.created_at))).first()
+        if known is None:
+            conversation = Conversation(user_id=item.user_id, role=item.role, created_at=item.created_at)
+            db.add(conversation)
+            await db.flush()
+            known = (conversation.id, conversation.created_at, None)
+        conversations[key] = tuple(known)
+        return known[0]
+
+
+async def history_page(db, user_id, role: str, cursor: str = None, limit: int = 50):
+    """
+    One page of a user's messages for `role`, newest first, across all of
+    their conversations. Keyset pagination on (created_at, id): every page
+    is an index range scan, however deep the client has scrolled.
+    """
+    stmt = (
+        select(Message)
+        .where(Message.user_id == user_id, Message.role == role)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        created_at, message_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            Message.created_at < created_at,
+            and_(Message.created_at == created_at, Message.id < message_id),
+        ))
+    messages = list((await db.scalars(stmt)).all())
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1].created_at, messages[-1].id)
+    return messages, next_cursor
+
+
+transcript_log = TranscriptLog()
+register_counters("transcripts", lambda: transcript_log.metrics)
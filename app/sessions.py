@@ -0,0 +1,246 @@
+import asyncio
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from starlette.datastructures import MutableHeaders
+from starlette.requests import cookie_parser
+from app.cache import LRUCache
+from app.metrics import register_counters
+
+# "sqlite" shares sessions between the workers on this host through a local
+# database file; "memory" keeps them in this process, for a single worker.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.sqlite3")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(14 * 24 * 60 * 60)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "100000"))
+SESSION_COOKIE = os.getenv("SESSION_COOKIE", "sid")
+SESSION_HTTPS_ONLY = os.getenv("SESSION_HTTPS_ONLY", "false").lower() == "true"
+# Cookie of the old signed-cookie sessions, expired on sight
+LEGACY_SESSION_COOKIE = "session"
+
+
+class MemorySessionStore:
+    """Sessions for a single process, expired lazily by the LRU."""
+    blocking = False
+
+    def __init__(self, max_entries: int = SESSION_MAX_ENTRIES):
+        self._sessions = LRUCache(maxsize=max_entries)
+
+    def load(self, session_id: str):
+        data = self._sessions.get(session_id)
+        return None if data is None else dict(data)
+
+    def save(self, session_id: str, data: dict, ttl: float):
+        self._sessions.set(session_id, dict(data), ttl=ttl)
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id)
+
+
+class SQLiteSessionStore:
+    """Sessions shared by all workers through a local SQLite file."""
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id: str):
+        row = self._connect().execute(
+            "SELECT data FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def save(self, session_id: str, data: dict, ttl: float):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+            (session_id, json.dumps(data), now + ttl),
+        )
+        self._writes += 1
+        if self._writes % 500 == 0:
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def delete(self, session_id: str):
+        self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+class LazySession(MutableMapping):
+    """
+    `request.session` for one request. The stored data is only loaded when
+    a route asks for it, so requests that never look at the session (static
+    files, API calls with a bearer token) cost nothing. Async routes call
+    `await request.session.load()` first, which keeps a blocking store off
+    the event loop; sync routes run in a thread and may just access it.
+    Assigning a key marks the session for saving; mutate nested values by
+    assigning them again.
+    """
+
+    def __init__(self, store, session_id: str = None):
+        self.store = store
+        self.id = session_id
+        self.loaded = False
+        self.modified = False
+        self.rotated_from = None
+        self._data = None
+
+    async def load(self) -> "LazySession":
+        if self._data is None:
+            data = None
+            if self.id:
+                if self.store.blocking:
+                    data = await asyncio.to_thread(self.store.load, self.id)
+                else:
+                    data = self.store.load(self.id)
+            self._loaded(data)
+        return self
+
+    def _load(self) -> dict:
+        if self._data is None:
+            self._loaded(self.store.load(self.id) if self.id else None)
+        return self._data
+
+    def _loaded(self, data):
+        if data is None:
+            # Unknown or expired: never adopt an id the client made up
+            self.id = None
+        self._data = data or {}
+        self.loaded = True
+        metrics["loads"] += 1
+
+    async def rotate(self):
+        """Moves the data to a new id when saved, e.g. once the user has logged in."""
+        await self.load()
+        if self.id is not None:
+            self.rotated_from = self.id
+            self.id = None
+        self.modified = True
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def clear(self):
+        self._data = {}
+        self.modified = True
+
+
+metrics = {"loads": 0, "saves": 0, "created": 0, "deleted": 0}
+
+
+class ServerSessionMiddleware:
+    """
+    Server-side sessions behind an opaque id cookie, in place of Starlette's
+    SessionMiddleware which signs the whole session into the cookie. The
+    cookie stays ~40 bytes however much the session holds, and the session
+    is only written back when a route changed it.
+    """
+
+    def __init__(self, app, store, cookie_name: str = SESSION_COOKIE, ttl: float = SESSION_TTL_SECONDS,
+                 https_only: bool = SESSION_HTTPS_ONLY):
+        self.app = app
+        self.store = store
+        self.cookie_name = cookie_name
+        self.ttl = ttl
+        self.security_flags = "httponly; samesite=lax" + ("; secure" if https_only else "")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        cookies = {}
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                cookies = cookie_parser(value.decode("latin-1"))
+                break
+        session = LazySession(self.store, cookies.get(self.cookie_name))
+        scope["session"] = session
+        if scope["type"] == "websocket":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                cookie = await self._commit(session, had_cookie=self.cookie_name in cookies)
+                if cookie is not None:
+                    headers.append("Set-Cookie", cookie)
+                if LEGACY_SESSION_COOKIE in cookies and LEGACY_SESSION_COOKIE != self.cookie_name:
+                    headers.append("Set-Cookie", self._cookie(LEGACY_SESSION_COOKIE, "null", 0))
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+    async def _call(self, func, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def _cookie(self, name: str, value: str, max_age: int) -> str:
+        return f"{name}={value}; path=/; Max-Age={max_age}; {self.security_flags}"
+
+    async def _commit(self, session: LazySession, had_cookie: bool):
+        """Saves a changed session; returns the Set-Cookie value, if one is needed."""
+        if not session.modified:
+            return None
+        if session.rotated_from is not None:
+            await self._call(self.store.delete, session.rotated_from)
+        if not session._data:
+            if session.id is not None:
+                await self._call(self.store.delete, session.id)
+                metrics["deleted"] += 1
+            return self._cookie(self.cookie_name, "null", 0) if had_cookie else None
+        if session.id is None:
+            session.id = secrets.token_urlsafe(32)
+            metrics["created"] += 1
+        await self._call(self.store.save, session.id, session._data, self.ttl)
+        metrics["saves"] += 1
+        return self._cookie(self.cookie_name, session.id, int(self.ttl))
+
+
+def create_store():
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore(SESSION_SQLITE_PATH)
+    if SESSION_BACKEND != "memory":
+        raise ValueError(f"Unknown SESSION_BACKEND: {SESSION_BACKEND}")
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        # Each worker would only know its own logins
+        raise ValueError("SESSION_BACKEND=memory needs a single worker, use sqlite")
+    return MemorySessionStore()
+
+
+session_store = create_store()
+register_counters("sessions", lambda: metrics)
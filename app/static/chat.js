@@ -0,0 +1,150 @@
+let role = "teacher";
+
+function setRole(btn, r) {
+    role = r;
+    document.querySelectorAll(".role-tabs button")
+        .forEach(b => b.classList.remove("active"));
+    btn.classList.add("active");
+}
+
+document.getElementById("user-input").addEventListener("keydown", function (event) {
+    if (event.key === "Enter") {
+        event.preventDefault();
+        sendMessage();
+    }
+});
+
+// One WebSocket for all messages: authenticated once via the session
+// cookie, replies for several messages can stream at the same time.
+// Unfinished replies are resumed from the last offset after a reconnect.
+const replies = {};
+const outbox = [];
+let socket = null;
+let retries = 0;
+let nextId = 0;
+
+function connect() {
+    const scheme = location.protocol === "https:" ? "wss" : "ws";
+    socket = new WebSocket(`${scheme}://${location.host}/ws/chat`);
+    socket.onopen = () => {
+        retries = 0;
+        for (const [id, reply] of Object.entries(replies)) {
+            socket.send(JSON.stringify({ type: "resume", id, offset: reply.end }));
+        }
+        while (outbox.length) socket.send(outbox.shift());
+    };
+    socket.onmessage = (event) => handleFrame(JSON.parse(event.data));
+    socket.onclose = (event) => {
+        // Policy violation or an application code: the session is gone or
+        // not allowed here, reconnecting would only be refused again
+        if (event.code === 1008 || (event.code >= 4000 && event.code < 5000)) {
+            showLoginPrompt();
+            return;
+        }
+        setTimeout(connect, Math.min(500 * 2 ** retries++, 10000));
+    };
+}
+
+function showLoginPrompt() {
+    for (const [id, reply] of Object.entries(replies)) {
+        reply.info.textContent = "";
+        delete replies[id];
+    }
+    const chat = document.getElementById("chat-box");
+    const bubble = document.createElement("div");
+    bubble.className = "bubble bot";
+    const link = document.createElement("a");
+    link.href = "/auth/login";
+    link.textContent = "Log in again";
+    bubble.append("Your session has ended. ", link, " to keep chatting.");
+    chat.appendChild(bubble);
+    chat.scrollTop = chat.scrollHeight;
+}
+
+function send(frame) {
+    const data = JSON.stringify(frame);
+    if (socket && socket.readyState === WebSocket.OPEN) socket.send(data);
+    else outbox.push(data);
+}
+
+function handleFrame(frame) {
+    const reply = replies[frame.id];
+    if (!reply) return;
+    const chat = document.getElementById("chat-box");
+    if (frame.type === "token") {
+        if (frame.offset !== reply.end) return;
+        reply.text += frame.text;
+        reply.end = frame.end;
+        reply.body.innerHTML = formatText(reply.text);
+        chat.scrollTop = chat.scrollHeight;
+        return;
+    }
+    if (frame.type === "done") {
+        reply.info.textContent = `In: ${frame.input_words} | Out: ${frame.output_words}`;
+    } else if (frame.type === "cancelled") {
+        reply.info.textContent = "Stopped";
+    } else if (frame.type === "error") {
+        if (!reply.text) reply.body.innerHTML = formatText(frame.detail);
+        reply.info.textContent = "";
+    }
+    delete replies[frame.id];
+    chat.scrollTop = chat.scrollHeight;
+}
+
+function sendMessage() {
+    const input = document.getElementById("user-input");
+    const msg = input.value.trim();
+    if (!msg) return;
+
+    const chat = document.getElementById("chat-box");
+    // Not innerHTML +=, which would re-create the bubbles of replies still streaming
+    chat.insertAdjacentHTML("beforeend", `<div class="bubble user">${formatText(msg)}</div>`);
+    input.value = "";
+
+    const id = `${Date.now().toString(36)}-${nextId++}`;
+    const bubble = document.createElement("div");
+    bubble.className = "bubble bot";
+    const body = document.createElement("div");
+    const info = document.createElement("div");
+    info.className = "token-info";
+    const stop = document.createElement("a");
+    stop.href = "#";
+    stop.textContent = "Stop";
+    stop.onclick = (event) => {
+        event.preventDefault();
+        send({ type: "cancel", id });
+    };
+    info.appendChild(stop);
+    bubble.append(body, info);
+    chat.appendChild(bubble);
+    chat.scrollTop = chat.scrollHeight;
+
+    replies[id] = { body, info, text: "", end: 0 };
+    send({ type: "chat", id, message: msg, role });
+    input.focus();
+}
+
+async function confirmClear() {
+    const ok = confirm(
+        "Are you sure you want to clear the session?\n\nThis will erase the conversation memory."
+    );
+    if (!ok) return;
+
+    await clearChat();
+}
+
+async function clearChat() {
+    for (const id of Object.keys(replies)) send({ type: "cancel", id });
+    await fetch("/clear", { method: "POST" });
+    document.getElementById("chat-box").innerHTML = "";
+}
+
+connect();
+
+function formatText(text) {
+    return text
+        .replace(/&/g, "&amp;")
+        .replace(/</g, "&lt;")
+        .replace(/>/g, "&gt;")
+        .replace(/\n/g, "<br>");
+}
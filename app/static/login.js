@@ -0,0 +1,127 @@
+function toggleAuth() {
+    const loginForm = document.getElementById('login-form');
+    const signupForm = document.getElementById('signup-form');
+    const otpForm = document.getElementById('otp-form');
+    const title = document.getElementById('auth-title');
+    const toggleText = document.getElementById('toggle-text');
+    const googleBtn = document.getElementById('google-btn');
+    const divider = document.getElementById('auth-divider');
+
+    if (loginForm.style.display === 'none' && otpForm.style.display === 'none') {
+        loginForm.style.display = 'flex';
+        signupForm.style.display = 'none';
+        otpForm.style.display = 'none';
+        title.innerText = 'Welcome Back';
+        toggleText.innerText = "New here? Create an account";
+        toggleText.style.display = 'block';
+        googleBtn.style.display = 'flex';
+        divider.style.display = 'block';
+    } else {
+        loginForm.style.display = 'none';
+        signupForm.style.display = 'flex';
+        otpForm.style.display = 'none';
+        title.innerText = 'Join AI Chat';
+        toggleText.innerText = "Already have an account? Sign In";
+        toggleText.style.display = 'block';
+        googleBtn.style.display = 'flex';
+        divider.style.display = 'block';
+    }
+}
+
+function resetLogin() {
+    document.getElementById('otp-form').style.display = 'none';
+    document.getElementById('login-form').style.display = 'flex';
+    document.getElementById('toggle-text').style.display = 'block';
+    document.getElementById('google-btn').style.display = 'flex';
+    document.getElementById('auth-divider').style.display = 'block';
+    document.getElementById('auth-title').innerText = 'Welcome Back';
+}
+
+document.getElementById('login-form').onsubmit = async (e) => {
+    e.preventDefault();
+    const email = document.getElementById('email').value;
+    const password = document.getElementById('password').value;
+
+    if (password) {
+        // Regular Password Login
+        const formData = new FormData();
+        formData.append('username', email);
+        formData.append('password', password);
+
+        const res = await fetch('/auth/login', {
+            method: 'POST',
+            body: formData
+        });
+
+        if (res.ok) {
+            const data = await res.json();
+            window.location.href = `/auth/set_session?token=${data.access_token}&email=${email}`;
+        } else {
+            const err = await res.json();
+            alert('Authentication failed: ' + (err.detail || 'Please check your credentials.'));
+        }
+    } else {
+        // OTP Login Initiation
+        const res = await fetch('/auth/email-login', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ email: email })
+        });
+
+        if (res.ok) {
+            document.getElementById('login-form').style.display = 'none';
+            document.getElementById('otp-form').style.display = 'flex';
+            document.getElementById('display-email').innerText = email;
+            document.getElementById('toggle-text').style.display = 'none';
+            document.getElementById('google-btn').style.display = 'none';
+            document.getElementById('auth-divider').style.display = 'none';
+            document.getElementById('auth-title').innerText = 'Verify Identity';
+        } else {
+            const err = await res.json();
+            alert('Error: ' + (err.detail || 'Could not send OTP.'));
+        }
+    }
+};
+
+document.getElementById('otp-form').onsubmit = async (e) => {
+    e.preventDefault();
+    const email = document.getElementById('display-email').innerText;
+    const otp = document.getElementById('otp').value;
+
+    const res = await fetch('/auth/verify-otp', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ email: email, otp: otp })
+    });
+
+    if (res.ok) {
+        const data = await res.json();
+        window.location.href = `/auth/set_session?token=${data.access_token}&email=${email}`;
+    } else {
+        const err = await res.json();
+        alert('Verification failed: ' + (err.detail || 'Invalid code.'));
+    }
+};
+
+document.getElementById('signup-form').onsubmit = async (e) => {
+    e.preventDefault();
+    const payload = {
+        name: document.getElementById('signup-name').value,
+        email: document.getElementById('signup-email').value,
+        password: document.getElementById('signup-password').value
+    };
+
+    const res = await fetch('/auth/signup', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
+    });
+
+    if (res.ok) {
+        alert('Account created! You can now sign in.');
+        toggleAuth();
+    } else {
+        const err = await res.json();
+        alert('Signup failed: ' + err.detail);
+    }
+};
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import threading
+from urllib.parse import urlsplit
+import httpx
+
+try:
+    import h2  # noqa: F401 (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true" and HTTP2_AVAILABLE
+# Sized to GROQ_MAX_CONCURRENT_REQUESTS; with HTTP/2 most requests share
+# one multiplexed connection per host anyway.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "300"))
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+# Longest silence between two reads. A non-streamed completion only starts
+# answering once it is fully generated, so this bounds generation time too.
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+# How long a streamed reply may take to produce its first token
+HTTP_FIRST_BYTE_TIMEOUT = float(os.getenv("HTTP_FIRST_BYTE_TIMEOUT", "20"))
+
+# Re-warm the pool this often so the first chat after a quiet period does
+# not pay for TCP + TLS again. 0 only warms once at startup.
+HTTP_PREWARM_INTERVAL = float(os.getenv("HTTP_PREWARM_INTERVAL", "240"))
+HTTP_PREWARM_CONNECTIONS = int(os.getenv("HTTP_PREWARM_CONNECTIONS", "2"))
+
+TIMEOUT = httpx.Timeout(
+    connect=HTTP_CONNECT_TIMEOUT,
+    read=HTTP_READ_TIMEOUT,
+    write=HTTP_WRITE_TIMEOUT,
+    pool=HTTP_POOL_TIMEOUT,
+)
+LIMITS = httpx.Limits(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+)
+
+log = logging.getLogger(__name__)
+
+
+class SharedTransport(httpx.AsyncBaseTransport):
+    """
+    One connection pool for every outbound client. Clients come and go
+    (Authlib builds one per OAuth call), so closing a client leaves the pool
+    open; shutdown() closes it for real.
+
+    Clients may pass their own timeouts, but a phase left unbounded (the
+    genai SDK sends timeout=None unless configured) gets ours.
+    """
+
+    def __init__(self):
+        self._transport = httpx.AsyncHTTPTransport(http2=HTTP2_ENABLED, limits=LIMITS)
+        self._defaults = TIMEOUT.as_dict()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        timeout = request.extensions.get("timeout") or {}
+        if any(timeout.get(phase) is None for phase in self._defaults):
+            request.extensions["timeout"] = {
+                phase: default if timeout.get(phase) is None else timeout[phase]
+                for phase, default in self._defaults.items()
+            }
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+    async def shutdown(self):
+        await self._transport.aclose()
+
+
+# Built on first use: the SSL context and HTTP/2 setup cost ~150ms, which
+# should not be paid by merely importing the app.
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> SharedTransport:
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = SharedTransport()
+    return _transport
+
+
+def async_client(**kwargs) -> httpx.AsyncClient:
+    """An httpx client on the shared pool with the default timeouts."""
+    kwargs.setdefault("timeout", TIMEOUT)
+    return httpx.AsyncClient(transport=get_transport(), **kwargs)
+
+
+async def first_byte_timeout(stream, timeout: float = HTTP_FIRST_BYTE_TIMEOUT):
+    """
+    Passes `stream` through, raising TimeoutError when its first item takes
+    longer than `timeout`. Since nothing has been sent yet at that point,
+    the provider router can still fail over.
+    """
+    iterator = stream.__aiter__()
+    try:
+        first = await asyncio.wait_for(iterator.__anext__(), timeout)
+    except StopAsyncIteration:
+        return
+    yield first
+    async for item in iterator:
+        yield item
+
+
+class Prewarmer:
+    """Opens connections to the upstream origins before traffic needs them."""
+
+    def __init__(self, client: httpx.AsyncClient = None):
+        self.client = client
+        self.origins = []
+        self._task = None
+
+    def add_origin(self, url: str):
+        parts = urlsplit(str(url))
+        origin = f"{parts.scheme}://{parts.netloc}"
+        if origin not in self.origins:
+            self.origins.append(origin)
+
+    async def _touch(self, origin: str):
+        try:
+            # Any answer will do, the point is the TCP + TLS handshake
+            await self.client.head(origin)
+        except httpx.HTTPError as e:
+            log.warning("Could not prewarm connection to %s: %s", origin, e)
+
+    async def warm(self):
+        if self.client is None:
+            self.client = await asyncio.to_thread(async_client)
+        await asyncio.gather(*(
+            self._touch(origin)
+            for origin in self.origins
+            for _ in range(HTTP_PREWARM_CONNECTIONS)
+        ))
+
+    async def _run(self):
+        while True:
+            await self.warm()
+            if HTTP_PREWARM_INTERVAL <= 0:
+                return
+            await asyncio.sleep(HTTP_PREWARM_INTERVAL)
+
+    def start(self):
+        # In the background: startup must not wait on upstream handshakes
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if _transport is not None:
+            await _transport.shutdown()
+
+
+prewarmer = Prewarmer()
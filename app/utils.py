@@ -1,12 +1,18 @@
+import asyncio
 import bcrypt
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 from app.config import get_secret_key
-from app.database import get_db
+from app.database import SessionLocal
+from app.cache import LRUCache
+from app.metrics import register_caches
 from app import models
 
 SECRET_KEY = get_secret_key()
@@ -15,11 +21,49 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
+# Hot tokens skip the HMAC check and the users query. Cached users are
+# detached snapshots; auth routes call invalidate_user() when a row changes.
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+_token_cache = LRUCache(maxsize=USER_CACHE_MAX_ENTRIES)
+_user_cache = LRUCache(maxsize=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL_SECONDS)
+register_caches({"token": _token_cache, "user": _user_cache})
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event
+# loop. Jobs beyond workers + queue are rejected with 503 instead of piling up.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_jobs = 0
+
 def verify_password(plain_password: str, hashed_password: str):
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def get_password_hash(password: str):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+async def _run_hash_job(func, *args):
+    global _hash_jobs
+    if _hash_jobs >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _hash_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, func, *args)
+    finally:
+        _hash_jobs -= 1
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    return await _run_hash_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str):
+    return await _run_hash_job(get_password_hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -31,23 +75,59 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def decode_token(token: str) -> dict:
+    """
+    Verifies and decodes a JWT, caching the payload until the token expires.
+    Raises JWTError for invalid tokens.
+    """
+    payload = _token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    ttl = payload.get("exp", 0) - time.time()
+    if ttl > 0:
+        _token_cache.set(token, payload, ttl=ttl)
+    return payload
+
+async def load_user(email: str):
+    user = _user_cache.get(email)
+    if user is not None:
+        return user
+
+    async with SessionLocal() as db:
+        result = await db.execute(select(models.User).where(models.User.email == email))
+        user = result.scalars().first()
+        if user is None:
+            return None
+        db.expunge(user)
+    _user_cache.set(email, user)
+    return user
+
+def invalidate_user(email: str):
+    _user_cache.pop(email)
+
+async def user_from_token(token: Optional[str]):
+    """The user a bearer token belongs to, or None when it is missing or invalid."""
     if not token:
-        raise credentials_exception
+        return None
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
+        email = decode_token(token).get("sub")
     except JWTError:
-        raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.email == email).first()
+        return None
+    if email is None:
+        return None
+    return await load_user(email)
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)):
+    # Bearer token from API clients, else the browser's login session
+    if not token:
+        token = (await request.session.load()).get("token")
+    user = await user_from_token(token)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
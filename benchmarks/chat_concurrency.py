@@ -0,0 +1,119 @@
+"""
+Load benchmark for the async Groq chat path.
+
+Starts a local stub of the Groq chat-completions API that answers after a
+fixed delay (as one JSON body, or as SSE chunks when the client streams,
+which roles with a stop condition do internally), points the Groq client at it and fires batches of concurrent
+get_groq_response() calls. With the blocking client every call pinned a
+threadpool slot (~40 per worker); the async path should scale until
+GROQ_MAX_CONCURRENT_REQUESTS.
+
+Usage:
+    python -m benchmarks.chat_concurrency [--latency 1.0] [--levels 1,10,50,100,200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+STUB_LATENCY = 1.0
+STUB_REPLY = "Python is a programming language."
+
+
+def sse_chunks():
+    base = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": "llama-3.3-70b-versatile"}
+    for word in STUB_REPLY.split(" "):
+        delta = {"index": 0, "delta": {"content": word + " "}, "finish_reason": None}
+        yield f"data: {json.dumps({**base, 'choices': [delta]})}\n\n"
+    done = {"index": 0, "delta": {}, "finish_reason": "stop"}
+    yield f"data: {json.dumps({**base, 'choices': [done]})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def fake_completion(request):
+    body = await request.json()
+    await asyncio.sleep(STUB_LATENCY)
+    if body.get("stream"):
+        return StreamingResponse(sse_chunks(), media_type="text/event-stream")
+    return JSONResponse({
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "llama-3.3-70b-versatile",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": STUB_REPLY},
+        }],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 6, "total_tokens": 16},
+    })
+
+
+stub_app = Starlette(routes=[Route("/openai/v1/chat/completions", fake_completion, methods=["POST"])])
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_level(get_groq_response, concurrency: int):
+    # A distinct prompt and user per call, otherwise the response cache and
+    # single-flight answer all but the first call without reaching the stub
+    async def one(i: int):
+        start = time.perf_counter()
+        reply, _, _ = await get_groq_response(
+            f"What is python? (call {concurrency}-{i})", "interviewer", user_id=i, raise_errors=True
+        )
+        assert reply.strip(), "empty reply from the stub"
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one(i) for i in range(concurrency)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{concurrency:>6} {wall:>9.2f}s {concurrency / wall:>10.1f} {p50:>8.2f}s {p99:>8.2f}s")
+
+
+async def main(levels):
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(stub_app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    os.environ.setdefault("GROQ_API_KEY", "stub")
+    # The stub has no quota; keep the client-side limiter out of the way
+    os.environ.setdefault("GROQ_RPM", "1000000")
+    os.environ.setdefault("GROQ_TPM", "1000000000")
+    os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{port}"
+    from app.services.groq_service import get_groq_response
+
+    print(f"stub latency {STUB_LATENCY:.2f}s")
+    print(f"{'conc':>6} {'wall':>10} {'req/s':>10} {'p50':>9} {'p99':>9}")
+    for level in levels:
+        await run_level(get_groq_response, level)
+
+    server.should_exit = True
+    await server_task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--levels", default="1,10,50,100,200")
+    args = parser.parse_args()
+    STUB_LATENCY = args.latency
+    sys.exit(asyncio.run(main([int(x) for x in args.levels.split(",")])))
@@ -0,0 +1,104 @@
+"""
+Login storm benchmark.
+
+Fires a burst of password verifications through a small ASGI app while a
+probe keeps calling a cheap endpoint on the same event loop, once with
+bcrypt running inline (the old behaviour) and once through the bounded
+worker pool in app.utils. Reports login throughput, how many logins were
+shed with 503, and the probe's p50/p99 latency during the storm.
+
+Usage:
+    python -m benchmarks.login_storm [--logins 64] [--rounds 12]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+# app.utils imports app.database, which needs a database URL; nothing is
+# written to it
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(tempfile.gettempdir(), 'login_storm.db')}"
+)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def build_app(utils, hashed: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/login/inline")
+    async def login_inline():
+        return {"ok": utils.verify_password("hunter2", hashed)}
+
+    @app.post("/login/pooled")
+    async def login_pooled():
+        return {"ok": await utils.verify_password_async("hunter2", hashed)}
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+async def storm(client: httpx.AsyncClient, path: str, logins: int):
+    probe_latencies = []
+    done = asyncio.Event()
+
+    async def probe():
+        # Latency is measured from when the ping was due, so time spent
+        # waiting for a blocked event loop is included.
+        while not done.is_set():
+            due = time.perf_counter() + 0.005
+            await asyncio.sleep(0.005)
+            await client.get("/ping")
+            probe_latencies.append(time.perf_counter() - due)
+
+    async def login():
+        return (await client.post(path)).status_code
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(login() for _ in range(logins)))
+    wall = time.perf_counter() - start
+    done.set()
+    await probe_task
+
+    ok = statuses.count(200)
+    print(
+        f"{path:<15} {ok / wall:>9.1f} {statuses.count(503):>6} "
+        f"{percentile(probe_latencies, 0.5) * 1000:>9.1f}ms {percentile(probe_latencies, 0.99) * 1000:>9.1f}ms"
+    )
+
+
+async def main(logins: int):
+    from app import utils
+
+    hashed = utils.get_password_hash("hunter2")
+    app = build_app(utils, hashed)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{logins} logins, bcrypt rounds={utils.BCRYPT_ROUNDS}, workers={utils.PASSWORD_HASH_WORKERS}")
+        print(f"{'mode':<15} {'logins/s':>9} {'shed':>6} {'ping p50':>11} {'ping p99':>11}")
+        await storm(client, "/login/inline", logins)
+        await storm(client, "/login/pooled", logins)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    sys.exit(asyncio.run(main(args.logins)))
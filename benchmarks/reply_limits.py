@@ -0,0 +1,79 @@
+"""
+Stop conditions of app.services.reply_limits on canned replies.
+
+Streams each reply below through ReplyLimit in small chunks and checks where
+it is cut off. Exits non-zero when a reply is cut in the wrong place.
+
+Usage:
+    python -m benchmarks.reply_limits [--chunk 7]
+"""
+import argparse
+import sys
+
+from app.services.reply_limits import CorrectedCodeStop, NumberedListStop, OutputBudgets, ReplyLimit
+
+BROKEN = "```python\ndef add(a, b)\n    return a + b\n```\n"
+FIXED = "```python\ndef add(a, b):\n    return a + b\n```"
+
+# (name, stop condition, reply, expected output)
+CASES = [
+    (
+        "corrected code after the quoted snippet",
+        CorrectedCodeStop,
+        "The indentation is incorrect here:\n" + BROKEN + "Corrected code:\n" + FIXED + "\nExplanation: ...",
+        "The indentation is incorrect here:\n" + BROKEN + "Corrected code:\n" + FIXED,
+    ),
+    (
+        "fixed version heading",
+        CorrectedCodeStop,
+        "Here is the fixed version:\n" + FIXED + "\nThe colon was missing.",
+        "Here is the fixed version:\n" + FIXED,
+    ),
+    (
+        "quoted snippet without a fix",
+        CorrectedCodeStop,
+        "To fix this, look at:\n" + BROKEN + "It is not working because of the colon.",
+        "To fix this, look at:\n" + BROKEN + "It is not working because of the colon.",
+    ),
+    (
+        "three questions",
+        lambda: NumberedListStop(3),
+        "1. What is a list?\n2. What is a tuple?\n3. What is a set?\n4. What is a dict?\n",
+        "1. What is a list?\n2. What is a tuple?\n3. What is a set?",
+    ),
+    (
+        "item number split across chunks",
+        lambda: NumberedListStop(9),
+        "".join(f"{i}. Question {i}?\n" for i in range(1, 12)),
+        "".join(f"{i}. Question {i}?\n" for i in range(1, 10)).rstrip(),
+    ),
+]
+
+
+def run(make_stop, reply: str, chunk: int) -> str:
+    limit = ReplyLimit(OutputBudgets(), "bench", "bench", 1000, make_stop())
+    out = []
+    for start in range(0, len(reply), chunk):
+        out.append(limit.feed(reply[start:start + chunk]))
+        if limit.stopped:
+            break
+    out.append(limit.flush())
+    return "".join(out).rstrip()
+
+
+def main(chunk: int) -> int:
+    failures = 0
+    for name, make_stop, reply, expected in CASES:
+        got = run(make_stop, reply, chunk)
+        ok = got == expected
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':<5} {name}")
+        if not ok:
+            print(f"      expected {expected!r}\n      got      {got!r}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk", type=int, default=7)
+    sys.exit(main(parser.parse_args().chunk))
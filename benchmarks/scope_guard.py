@@ -0,0 +1,87 @@
+"""
+Accuracy and throughput of the scope guard.
+
+Runs the labeled corpus below through the old substring-based check and the
+compiled single-pass guard in app.services.scope_guard, then times both.
+
+Usage:
+    python -m benchmarks.scope_guard [--repeat 20000]
+"""
+import argparse
+import re
+import timeit
+
+from app.services.scope_guard import ScopeGuard, classify
+
+# (message, role, expected allowed) under the Gemini topic policy
+CORPUS = [
+    ("What is Python?", "teacher", True),
+    ("Explain list comprehensions in python", "teacher", True),
+    ("Is this pythonic?", "teacher", True),
+    ("How does AI work?", "teacher", True),
+    ("Give me 10 AI interview questions", "interviewer", True),
+    ("what is artificial   intelligence", "teacher", True),
+    ("Machine Learning vs Deep Learning", "teacher", True),
+    ("Teach me deep learning basics", "teacher", True),
+    ("How do I add auth to a FastAPI app?", "teacher", True),
+    ("Generative AI-powered apps", "teacher", True),
+    ("def add(a, b):\n    return a + b\nprint(add(1, 2)", "debugger", True),
+    ("for i in range(10) print(i)", "debugger", True),
+    ("import numpy as np\nx = np.array([1, 2]", "debugger", True),
+    ("class Foo\n    pass", "debugger", True),
+    ("if x == 1 print('one'):", "debugger", True),
+    ("What did she said in the email?", "teacher", False),
+    ("Explain the main plot of Hamlet", "teacher", False),
+    ("Give me a recipe for pain au chocolat", "teacher", False),
+    ("Tell me about the Taj Mahal", "teacher", False),
+    ("What is the capital of Spain?", "interviewer", False),
+    ("Write me a poem about rain again", "teacher", False),
+    ("How do I maintain my car?", "teacher", False),
+    ("Which train goes to Chicago?", "interviewer", False),
+    ("Why does my code fail to compile", "debugger", False),
+    ("print the weather report", "teacher", False),
+]
+
+OLD_TOPICS = ["python", "ai", "artificial intelligence", "machine learning", "deep learning", "fastapi"]
+OLD_CODE_PATTERNS = [
+    r"\bprint\s*\(",
+    r"\bdef\s+\w+\(",
+    r"\bclass\s+\w+",
+    r"\bimport\s+\w+",
+    r"\bfor\s+\w+\s+in\s+",
+    r"\bif\s+.+:",
+]
+
+
+def old_is_allowed(message: str, role: str) -> bool:
+    msg = message.lower()
+    if role == "debugger" and any(re.search(p, message) for p in OLD_CODE_PATTERNS):
+        return True
+    return any(topic in msg for topic in OLD_TOPICS)
+
+
+def accuracy(check) -> float:
+    return sum(check(msg, role) == expected for msg, role, expected in CORPUS) / len(CORPUS)
+
+
+def throughput(check, repeat: int) -> float:
+    seconds = timeit.timeit(lambda: [check(msg, role) for msg, role, _ in CORPUS], number=repeat)
+    return repeat * len(CORPUS) / seconds
+
+
+def main(repeat: int):
+    guard = ScopeGuard(topics=("python", "ai", "machine_learning", "deep_learning", "fastapi"))
+    print(f"{len(CORPUS)} labeled messages, {repeat} rounds")
+    print(f"{'check':<10} {'accuracy':>9} {'msgs/s':>12}")
+    for name, check in (("substring", old_is_allowed), ("compiled", guard.is_allowed)):
+        print(f"{name:<10} {accuracy(check):>9.0%} {throughput(check, repeat):>12,.0f}")
+
+    for msg, role, expected in CORPUS:
+        if guard.is_allowed(msg, role) != expected:
+            print(f"  mismatch: {msg!r} ({role}) -> {sorted(classify(msg))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20000)
+    main(parser.parse_args().repeat)